@@ -0,0 +1,151 @@
+#!/usr/local/bin/python3.6
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+BUNDLE_FILE = 'estimating.pyz'
+BUNDLE_INTERPRETER = '/usr/local/bin/python3.6' # Same as the scripts; the bundle's bytecode is compiled by it
+BENCHMARK_RUNS = 20
+
+# Scripts in the bundle: command -> (script, module name inside the bundle)
+BUNDLE_SCRIPTS = {
+    'report': ('report-generation.py', 'report_generation'),
+    'weightlist': ('weightlist-generation.py', 'weightlist_generation'),
+}
+BUNDLE_DATA = ['steel-shapes.bin']
+
+# The bundle's entry point. Only the chosen script's module is imported, from its precompiled bytecode.
+BUNDLE_MAIN = '''import sys
+
+COMMANDS = {commands!r}
+
+if len(sys.argv) < 2 or sys.argv[1] not in COMMANDS:
+    print('USAGE: {bundle} ' + ' | '.join(COMMANDS) + ' [script arguments ...]')
+    exit(1)
+command = sys.argv.pop(1)
+__import__(COMMANDS[command]).main()
+'''
+
+# Run by the bundle's interpreter to compile one script: source, .pyc, name shown in tracebacks
+COMPILE_COMMAND = 'import py_compile, sys; py_compile.compile(sys.argv[1], cfile=sys.argv[2], dfile=sys.argv[3], doraise=True)'
+
+# FUNCTIONS
+
+def popFlag(args, flag):
+    """Remove a flag from args; True if it was there."""
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+
+def popOption(args, flag, default=None):
+    """Remove a '--flag value' pair from args and return the value (or default if the flag is absent)."""
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 >= len(args):
+            print('ERROR: '+flag+' requires a value')
+            exit(1)
+        value = args[i+1]
+        del args[i:i+2]
+        return value
+    return default
+
+
+def popIntOption(args, flag, default, minimum=0):
+    """popOption for a whole number of at least minimum."""
+    value = popOption(args, flag, default)
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        print('ERROR: '+flag+' needs a whole number of at least '+str(minimum))
+        exit(1)
+    return value
+
+
+def compileScript(interpreter, source, compiled, displayName):
+    """Compile source to a .pyc with the given interpreter, stopping with an ERROR line if that fails."""
+    try:
+        result = subprocess.run([interpreter, '-c', COMPILE_COMMAND, source, compiled, displayName])
+    except OSError as error:
+        print('ERROR: cannot run '+interpreter+' ('+str(error)+'); use --interpreter to name the Python to bundle for')
+        exit(1)
+    if result.returncode != 0:
+        print('ERROR: '+interpreter+' could not compile '+displayName)
+        exit(1)
+
+
+def writeBundle(bundleFileName, sourceDir, interpreter=BUNDLE_INTERPRETER):
+    """Write a zipapp holding each script as a sourceless .pyc, the data files, and a __main__.py dispatching on
+    the first argument. Bytecode only loads on the Python version that compiled it, so it is compiled by the
+    interpreter named on the bundle's first line; rebuild after upgrading it."""
+    commands = dict((command, module) for command, (script, module) in BUNDLE_SCRIPTS.items())
+    with tempfile.TemporaryDirectory() as buildDir:
+        # Compile everything first, so a failed build leaves no half-written bundle
+        for command, (script, module) in BUNDLE_SCRIPTS.items():
+            compileScript(interpreter, os.path.join(sourceDir, script), os.path.join(buildDir, module+'.pyc'), script)
+
+        with open(bundleFileName, 'wb') as bundleFile:
+            # The interpreter line goes ahead of the archive, so the bundle runs on its own
+            bundleFile.write(('#!'+interpreter+'\n').encode())
+            with zipfile.ZipFile(bundleFile, 'w', zipfile.ZIP_DEFLATED) as bundle:
+                bundle.writestr('__main__.py', BUNDLE_MAIN.format(commands=commands, bundle=os.path.basename(bundleFileName)))
+                for command, (script, module) in BUNDLE_SCRIPTS.items():
+                    bundle.write(os.path.join(buildDir, module+'.pyc'), module+'.pyc')
+                for dataFileName in BUNDLE_DATA:
+                    bundle.write(os.path.join(sourceDir, dataFileName), dataFileName)
+    os.chmod(bundleFileName, 0o755)
+
+
+def startupTimes(command, runs=BENCHMARK_RUNS):
+    """Wall clock seconds of each of several runs of a command, output discarded."""
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def printStartupBenchmark(bundleFileName, sourceDir, interpreter=BUNDLE_INTERPRETER, runs=BENCHMARK_RUNS):
+    """Time a trivial run (the usage message) of each script as source and from the bundle, on the bundle's
+    interpreter."""
+    print('\t'.join(['Startup', 'Runs', 'Min ms', 'Median ms']))
+    for command, (script, module) in BUNDLE_SCRIPTS.items():
+        for label, argv in (
+            (script, [interpreter, os.path.join(sourceDir, script)]),
+            (os.path.basename(bundleFileName)+' '+command, [interpreter, bundleFileName, command]),
+        ):
+            times = startupTimes(argv, runs)
+            print('\t'.join([label, str(runs), '%.1f' % (1000 * min(times)), '%.1f' % (1000 * statistics.median(times))]))
+
+
+def main():
+
+    args = sys.argv[1:]
+    isBenchmark = popFlag(args, '--benchmark')
+    runs = popIntOption(args, '--runs', BENCHMARK_RUNS, 1)
+    interpreter = popOption(args, '--interpreter', BUNDLE_INTERPRETER)
+
+    if len(args) > 1:
+        print('USAGE: bundle-generation.py [Bundle.pyz] [--interpreter /usr/local/bin/python3.6] [--benchmark [--runs 20]]')
+        exit(1)
+
+    bundleFileName = args[0] if args else BUNDLE_FILE
+    sourceDir = os.path.dirname(os.path.abspath(__file__))
+    writeBundle(bundleFileName, sourceDir, interpreter)
+    print('Wrote '+bundleFileName)
+
+    if isBenchmark:
+        print('')
+        printStartupBenchmark(bundleFileName, sourceDir, interpreter, runs)
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,167 @@
 #!/usr/local/bin/python3.6
 
+import array
+import bisect
+import collections
+import copy
+import io
+import itertools
+import json
 import math
+import mmap
+import os
 import re
+import struct
 import sys
+import time
+import zlib
 
-MESSAGE_OUTPUT = []
+# Modules that only some runs need (process pools, decompressors, the shape table builder) are imported where
+# they are used, so a plain report starts as fast as possible.
+
+# Compressed inputs, told apart by their first bytes
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+STDIN_INPUT = None # Opened once; '-' may be named as an input only once
+
+DIAGNOSTICS_CAP = 20 # Distinct messages kept per diagnostic code; the rest are only counted
 
 KERF = 0.25
 MAX_STOCK = 65
+RECONCILE_TOLERANCE = 0.05 # Cost report lb/ft this far off nominal (as a fraction) is a mismatch
+LENGTH_BUCKET = 0.5 # Length index bucket (ft); lengths round up to it, as on the weight list
+REMNANT_MIN_LENGTH = 2 # Shortest drop (ft) worth keeping in the remnant inventory
 STUB_LIST = ['Stub', 'stub', 'KP', 'kp']
 
+DNL_LIST = ['Plate', 'Cxn', 'Bucket']
+
 MISC_FACTOR = 0.15
 STRUCT_PRICE_FACTOR = 3.2
 
 DECKING_PRICE_FACTOR = 12
 SAFETY_LINE_PRICE_FACTOR = 20
 
+# Deck sheets: orderable lengths (ft), end lap where a run needs more than one sheet, and sheets per bundle
+DECK_MIN_SHEET = 4
+DECK_MAX_SHEET = 42
+DECK_SHEET_INCREMENT = 0.5
+DECK_END_LAP = 0.5
+DECK_SHEETS_PER_BUNDLE = 30
+DECK_COVER_WIDTH = 3 # ft, when the profile is not listed below
+DECK_COVER_WIDTHS = {'1.5A': 3, '1.5B': 3, '1.5F': 3, '2VLI': 3, '3VLI': 3, '3N': 2, '3W': 3}
+
 MF_HOURS_PER_POINT = 4
 MF_LABOR_RATE = 85
 
+# Factors a --scenarios grid may override, with their defaults
+SCENARIO_FACTORS = {
+    'STRUCT_PRICE_FACTOR': STRUCT_PRICE_FACTOR,
+    'MISC_FACTOR': MISC_FACTOR,
+    'DECKING_PRICE_FACTOR': DECKING_PRICE_FACTOR,
+    'SAFETY_LINE_PRICE_FACTOR': SAFETY_LINE_PRICE_FACTOR,
+    'MF_HOURS_PER_POINT': MF_HOURS_PER_POINT,
+    'MF_LABOR_RATE': MF_LABOR_RATE,
+}
+
+# Report sections, in print order, and the pipeline stage each one needs
+SECTION_STAGES = {
+    'struct': 'multed',
+    'deck': 'parsed',
+    'cxn': 'parsed',
+    'multing': 'multed',
+    'weightlist': 'joined',
+    'reconcile': 'joined',
+    'sheets': 'parsed',
+}
+DEFAULT_SECTIONS = ['struct', 'deck', 'cxn', 'multing', 'reconcile', 'sheets']
+
+# Report layout
+SPACING = '\t\t\t\t\t'
+WEIGHT_COLUMN = 'I'
+DATA_COLUMN = 'G'
+DATA_COLUMN_TWO = chr(ord(DATA_COLUMN) + 1)
+COUNT_COLUMN = 'D'
+SF_COLUMN = 'G'
+LF_COLUMN = chr(ord(SF_COLUMN) + 1)
+
+# STEEL SHAPES
+# Nominal weight per foot by canonical (nameClean) shape name, kept in a memory-mapped hash table built from the
+# sizes below. W, C and MC weights are in the name; HSS, angle and pipe weights come from the section geometry.
+SHAPE_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'steel-shapes.bin')
+SHAPE_TABLE = None
+SHAPE_MAGIC = b'SHP1'
+SHAPE_HEADER = struct.Struct('<4sII') # magic, slot count, record count
+SHAPE_SLOT = struct.Struct('<24sf') # canonical name, lb/ft
+STEEL_LB_PER_IN2_FT = 490.0 / 144 # 490 lb/ft^3
+
+SHAPE_W = {
+    4: [13], 5: [16, 19], 6: [9, 12, 15, 16, 20, 25],
+    8: [10, 13, 15, 18, 21, 24, 28, 31, 35, 40, 48, 58, 67],
+    10: [12, 15, 17, 19, 22, 26, 30, 33, 39, 45, 49, 54, 60, 68, 77, 88, 100, 112],
+    12: [14, 16, 19, 22, 26, 30, 35, 40, 45, 50, 53, 58, 65, 72, 79, 87, 96, 106, 120, 136, 152, 170, 190, 210, 230, 252, 279, 305, 336],
+    14: [22, 26, 30, 34, 38, 43, 48, 53, 61, 68, 74, 82, 90, 99, 109, 120, 132, 145, 159, 176, 193, 211, 233, 257, 283, 311, 342, 370, 398, 426, 455, 500, 550, 605, 665, 730],
+    16: [26, 31, 36, 40, 45, 50, 57, 67, 77, 89, 100],
+    18: [35, 40, 46, 50, 55, 60, 65, 71, 76, 86, 97, 106, 119, 130, 143, 158, 175, 192, 211, 234, 258, 283, 311],
+    21: [44, 48, 50, 55, 57, 62, 68, 73, 83, 93, 101, 111, 122, 132, 147, 166, 182, 201, 223, 248, 275],
+    24: [55, 62, 68, 76, 84, 94, 103, 104, 117, 131, 146, 162, 176, 192, 207, 229, 250, 279, 306, 335, 370],
+    27: [84, 94, 102, 114, 129, 146, 161, 178, 194, 217, 235, 258, 281, 307, 336, 368],
+    30: [90, 99, 108, 116, 124, 132, 148, 173, 191, 211, 235, 261, 292, 326, 357, 391],
+    33: [118, 130, 141, 152, 169, 201, 221, 241, 263, 291, 318, 354, 387],
+    36: [135, 150, 160, 170, 182, 194, 210, 231, 232, 247, 256, 262, 282, 302, 330, 361, 395, 441, 487, 529],
+}
+SHAPE_C = {
+    3: [4.1, 5, 6], 4: [5.4, 7.25], 5: [6.7, 9], 6: [8.2, 10.5, 13], 7: [9.8, 12.2, 14.75], 8: [11.5, 13.75, 18.75],
+    9: [13.4, 15, 20], 10: [15.3, 20, 25, 30], 12: [20.7, 25, 30], 15: [33.9, 40, 50],
+}
+SHAPE_MC = {
+    6: [12, 15.3, 16.3, 18], 8: [8.5, 18.7, 20, 21.4, 22.8], 10: [6.5, 8.4, 22, 25, 28.5, 33.6, 41.1],
+    12: [10.6, 14.3, 31, 35, 40, 45, 50], 13: [31.8, 35, 40, 50], 18: [42.7, 45.8, 51.9, 58],
+}
+SHAPE_WALLS = ['1/8', '3/16', '1/4', '5/16', '3/8', '7/16', '1/2', '5/8', '3/4', '7/8', '1', '1-1/8']
+SHAPE_L = [ # leg, leg, thinnest wall, thickest wall
+    ('2', '2', '1/8', '3/8'), ('2-1/2', '2-1/2', '3/16', '1/2'), ('3', '3', '3/16', '1/2'), ('3-1/2', '3-1/2', '1/4', '1/2'),
+    ('4', '4', '1/4', '3/4'), ('5', '5', '5/16', '7/8'), ('6', '6', '5/16', '1'), ('8', '8', '1/2', '1-1/8'),
+    ('3', '2', '3/16', '1/2'), ('3', '2-1/2', '3/16', '1/2'), ('3-1/2', '2-1/2', '1/4', '1/2'), ('3-1/2', '3', '1/4', '1/2'),
+    ('4', '3', '1/4', '5/8'), ('4', '3-1/2', '1/4', '1/2'), ('5', '3', '1/4', '1/2'), ('5', '3-1/2', '1/4', '3/4'),
+    ('6', '3-1/2', '5/16', '1/2'), ('6', '4', '5/16', '7/8'), ('7', '4', '3/8', '3/4'), ('8', '4', '1/2', '1'), ('8', '6', '1/2', '1'),
+]
+SHAPE_HSS_RECT = [ # height, width, thinnest wall, thickest wall
+    ('2', '2', '1/8', '1/4'), ('2-1/2', '2-1/2', '1/8', '5/16'), ('3', '2', '1/8', '1/4'), ('3', '3', '1/8', '3/8'),
+    ('3-1/2', '3-1/2', '1/8', '3/8'), ('4', '2', '1/8', '3/8'), ('4', '3', '1/8', '3/8'), ('4', '4', '1/8', '1/2'),
+    ('4-1/2', '4-1/2', '1/8', '1/2'), ('5', '2', '1/8', '5/16'), ('5', '3', '1/8', '1/2'), ('5', '4', '1/8', '1/2'),
+    ('5', '5', '1/8', '1/2'), ('5-1/2', '5-1/2', '1/8', '3/8'), ('6', '2', '1/8', '3/8'), ('6', '3', '1/8', '1/2'),
+    ('6', '4', '1/8', '1/2'), ('6', '5', '1/8', '1/2'), ('6', '6', '1/8', '5/8'), ('7', '3', '1/8', '1/2'),
+    ('7', '4', '1/8', '1/2'), ('7', '5', '1/8', '1/2'), ('7', '7', '1/8', '5/8'), ('8', '2', '1/8', '3/8'),
+    ('8', '3', '1/8', '1/2'), ('8', '4', '1/8', '5/8'), ('8', '6', '3/16', '5/8'), ('8', '8', '1/8', '5/8'),
+    ('9', '9', '1/8', '5/8'), ('10', '4', '1/8', '5/8'), ('10', '5', '3/16', '3/8'), ('10', '6', '3/16', '5/8'),
+    ('10', '8', '3/16', '5/8'), ('10', '10', '3/16', '5/8'), ('12', '4', '3/16', '5/8'), ('12', '6', '3/16', '5/8'),
+    ('12', '8', '3/16', '5/8'), ('12', '10', '1/4', '1/2'), ('12', '12', '3/16', '5/8'), ('14', '6', '3/16', '5/8'),
+    ('14', '10', '1/4', '5/8'), ('14', '14', '5/16', '5/8'), ('16', '8', '1/4', '5/8'), ('16', '12', '5/16', '5/8'),
+    ('16', '16', '5/16', '5/8'),
+]
+SHAPE_HSS_ROUND = { # outside diameter: wall thicknesses
+    '1.660': ['0.140'], '1.900': ['0.120', '0.145', '0.188'], '2.375': ['0.125', '0.154', '0.218', '0.250'],
+    '2.875': ['0.125', '0.203', '0.250'], '3.000': ['0.134', '0.250'], '3.500': ['0.125', '0.216', '0.250', '0.300'],
+    '4.000': ['0.125', '0.220', '0.237', '0.250', '0.313'], '4.500': ['0.125', '0.188', '0.237', '0.337'],
+    '5.000': ['0.125', '0.188', '0.250', '0.258', '0.312', '0.375', '0.500'], '5.563': ['0.134', '0.258', '0.375', '0.500'],
+    '6.000': ['0.125', '0.188', '0.250', '0.280', '0.312', '0.375', '0.500'], '6.625': ['0.125', '0.188', '0.250', '0.280', '0.312', '0.432', '0.500'],
+    '7.000': ['0.125', '0.188', '0.250', '0.317', '0.375', '0.500'], '7.500': ['0.188', '0.250', '0.312', '0.375', '0.500'],
+    '8.625': ['0.188', '0.250', '0.322', '0.375', '0.500', '0.625'], '10.000': ['0.188', '0.250', '0.312', '0.375', '0.500', '0.625'],
+    '10.750': ['0.250', '0.365', '0.500'], '12.750': ['0.250', '0.375', '0.500'], '14.000': ['0.250', '0.312', '0.375', '0.500', '0.625'],
+    '16.000': ['0.250', '0.312', '0.375', '0.438', '0.500', '0.625'],
+}
+SHAPE_PIPE = { # nominal size: outside diameter, Std wall, x-Strong wall, xx-Strong wall
+    '1/2': (0.840, 0.109, 0.147, None), '3/4': (1.050, 0.113, 0.154, None), '1': (1.315, 0.133, 0.179, None),
+    '1-1/4': (1.660, 0.140, 0.191, None), '1-1/2': (1.900, 0.145, 0.200, None), '2': (2.375, 0.154, 0.218, 0.436),
+    '2-1/2': (2.875, 0.203, 0.276, 0.552), '3': (3.500, 0.216, 0.300, 0.600), '3-1/2': (4.000, 0.226, 0.318, None),
+    '4': (4.500, 0.237, 0.337, 0.674), '5': (5.563, 0.258, 0.375, 0.750), '6': (6.625, 0.280, 0.432, 0.864),
+    '8': (8.625, 0.322, 0.500, 0.875), '10': (10.750, 0.365, 0.500, None), '12': (12.750, 0.375, 0.500, None),
+}
+
 # CLASSES
 
 class Material:
@@ -30,6 +173,18 @@ class Material:
         self.stockLength = 0
         self.weight = 0
         self.weightPerFoot = 0
+        self.pieces = 0
+        self.bars = 0
+        self.barsLowerBound = 0
+        self.barsL2 = 0
+        self.dropLength = 0
+        self.multSeconds = 0
+        self.cutPatterns = []
+        self.dropEstimate = None # (mixed bars, range low, range high) drop weight when --estimate-drop was used
+        self.lengthIndex = collections.Counter() # pieces per LENGTH_BUCKET, kept up to date as lengths are read
+        self.lengthCounts = collections.Counter() # pieces per exact length, likewise
+        self.shortest = 0
+        self.longest = 0
 
     def __str__(self):
         lengths = []
@@ -43,6 +198,24 @@ class Material:
             lengths.extend(tfData.lengths)
         return sorted(lengths, reverse = True)
 
+    def indexLength(self, length):
+        """Count one piece into the length indexes."""
+        self.lengthCounts[length] += 1
+        self.lengthIndex[math.ceil(round(length / LENGTH_BUCKET, 6)) * LENGTH_BUCKET] += 1
+        self.shortest = min(self.shortest, length) if self.shortest else length
+        self.longest = max(self.longest, length)
+
+    def mergeIndex(self, other):
+        """Add another material's length indexes onto this one."""
+        self.lengthIndex.update(other.lengthIndex)
+        self.lengthCounts.update(other.lengthCounts)
+        if other.shortest:
+            self.shortest = min(self.shortest, other.shortest) if self.shortest else other.shortest
+        self.longest = max(self.longest, other.longest)
+
+    def indexedPieces(self):
+        return sum(self.lengthIndex.values())
+
 class Takeoff:
     def __init__(self, plan='', typeName='', name='', rawName='', description='', sf=0, lf=0, count=0, lengths=[], weight=0, dnl=''):
         self.plan = plan
@@ -80,6 +253,14 @@ class Takeoff:
         else:
             return rowOne+'\n'+rowTwo
 
+    def merge(self, other):
+        """Add another export's counts, SF, LF, weight and lengths for the same takeoff onto this one."""
+        for field in ['count', 'sf', 'lf', 'weight']:
+            value = getattr(other, field)
+            if value != '':
+                setattr(self, field, (getattr(self, field) or 0) + value)
+        self.lengths.extend(other.lengths)
+
     def deckingSummary(self):
         return '\t'.join([
             self.dnl,
@@ -105,6 +286,241 @@ class Takeoff:
             self.name,
         ])
 
+    def weightList(self):
+
+        # Order: Qty, Name, Length (grouped), Weight (grouped)
+        weightPerLf = 0
+        if self.lf:
+            weightPerLf = float(self.weight) / float(self.lf)
+        weightDict = {}
+
+        if self.typeName not in DNL_LIST:
+            for length in self.lengths:
+
+                # Round up to nearest 6"
+                length = math.ceil(float(length)*2)/2
+                feet = math.floor(length)
+                lengthOut = "{0:d}\'".format(feet)
+                if length % 1: # non-integer foot length
+                    lengthOut = lengthOut+" 6\""
+
+                # Existing length
+                if (length in weightDict.keys()):
+                    weightDict[length]['qty'] += 1
+                    weightDict[length]['weight'] += round(weightPerLf * length)
+
+                # New length
+                else:
+                    weightDict[length] = {
+                        'qty' : 1,
+                        'name' : self.name,
+                        'lengthOut' : lengthOut,
+                        'weight' : round(weightPerLf * length),
+                    }
+
+        output = []
+        for length in sorted(weightDict.keys()):
+            output.append([
+                weightDict[length]['qty'],
+                '',
+                weightDict[length]['name'],
+                weightDict[length]['lengthOut'],
+                weightDict[length]['weight'],
+                weightPerLf,
+            ])
+        return output
+
+class Diagnostics:
+    """Warnings and notes raised while reading and reporting.
+
+    Records are typed by code and deduplicated: a repeat of the same code and message only bumps its count, and
+    after cap distinct messages per code the rest are only counted, so memory stays flat on bad exports.
+    target '' holds the records for the end of the report; 'stderr' or a .jsonl file name streams each new record
+    as it happens and writes the counts at the end."""
+    def __init__(self, target='', cap=DIAGNOSTICS_CAP):
+        self.target = target
+        self.cap = cap
+        self.records = {}
+        self.codeCounts = {}
+        self.stream = None
+        if target == 'stderr':
+            self.stream = sys.stderr
+        elif target:
+            self.stream = open(target, 'w')
+
+    def add(self, level, code, message, count=1, **fields):
+        counts = self.codeCounts.setdefault(code, {'distinct': 0, 'total': 0})
+        counts['total'] += count
+        key = (code, message)
+        if key in self.records:
+            self.records[key]['count'] += count
+            return
+        if counts['distinct'] >= self.cap:
+            return
+        counts['distinct'] += 1
+        record = {'level': level, 'code': code, 'message': message}
+        record.update(fields)
+        record['count'] = count
+        self.records[key] = record
+        self.emit(record)
+
+    def emit(self, record):
+        if self.stream is None:
+            return
+        if self.target == 'stderr':
+            print(record['level']+': '+record['message'], file=self.stream)
+        else:
+            self.stream.write(json.dumps(dict((k, v) for k, v in record.items() if k != 'count'))+'\n')
+        self.stream.flush()
+
+    def export(self):
+        """Records and per-code counts, to carry diagnostics back from a worker process."""
+        return list(self.records.values()), self.codeCounts
+
+    def absorb(self, exported):
+        records, codeCounts = exported
+        absorbed = {}
+        for record in records:
+            fields = dict(record)
+            level, code, message, count = fields.pop('level'), fields.pop('code'), fields.pop('message'), fields.pop('count')
+            self.add(level, code, message, count, **fields)
+            absorbed[code] = absorbed.get(code, 0) + count
+        for code, counts in codeCounts.items():
+            uncounted = counts['total'] - absorbed.get(code, 0)
+            if uncounted:
+                self.codeCounts.setdefault(code, {'distinct': 0, 'total': 0})['total'] += uncounted
+
+    def finish(self):
+        """Print the held records (default target), or write the per-code counts to the stream."""
+        if self.stream is None:
+            for record in self.records.values():
+                suffix = ' (x'+str(record['count'])+')' if record['count'] > 1 else ''
+                print(record['level']+': '+record['message']+suffix)
+        shown = {}
+        for record in self.records.values():
+            shown[record['code']] = shown.get(record['code'], 0) + record['count']
+        for code, counts in self.codeCounts.items():
+            hidden = counts['total'] - shown.get(code, 0)
+            if self.stream is None:
+                if hidden:
+                    print('NOTE: '+str(hidden)+' more '+code+' messages not shown')
+            elif self.target == 'stderr':
+                print('NOTE: '+code+': '+str(counts['total'])+' total, '+str(hidden)+' not shown', file=self.stream)
+            else:
+                self.stream.write(json.dumps({'level': 'SUMMARY', 'code': code, 'total': counts['total'], 'notShown': hidden})+'\n')
+        if self.stream not in (None, sys.stderr):
+            self.stream.close()
+
+class RemnantInventory:
+    """Usable drops kept between jobs. Per shape, remnants are bucketed by exact length (oldest first) under a
+    sorted list of the distinct lengths, so a best-fit lookup is a bisect, and adding or taking a remnant only
+    touches the sorted list when a length appears or runs out; remnants that repeat a length cost O(1)."""
+    def __init__(self):
+        self.remnants = {} # name -> (sorted distinct lengths, {length: deque of (order, job)})
+        self.added = 0
+
+    def add(self, name, length, job=''):
+        self.added += 1
+        lengths, buckets = self.remnants.setdefault(name, ([], {}))
+        if length not in buckets:
+            bisect.insort(lengths, length)
+            buckets[length] = collections.deque()
+        buckets[length].append((self.added, job))
+
+    def take(self, name, length):
+        """Remove and return the shortest remnant (length, job) at least as long as length, or None."""
+        if name not in self.remnants:
+            return None
+        lengths, buckets = self.remnants[name]
+        i = bisect.bisect_left(lengths, length)
+        if i == len(lengths):
+            return None
+        remnantLength = lengths[i]
+        order, job = buckets[remnantLength].popleft()
+        if not buckets[remnantLength]:
+            del buckets[remnantLength]
+            del lengths[i]
+        return (remnantLength, job)
+
+    def read(self, inventoryFile):
+        colDict = {}
+        firstLine = 1
+        for line in inventoryFile:
+            if isBlank(line):
+                continue
+            data = [i.strip().strip('\"') for i in line.strip().split(',')]
+            if firstLine:
+                colDict = createColDict(data)
+                firstLine = 0
+                continue
+            self.add(data[colDict['Name']], float(data[colDict['Length']]), data[colDict['Job']])
+
+    def write(self, inventoryFile):
+        inventoryFile.write('Name,Length,Job\n')
+        for name, (lengths, buckets) in sorted(self.remnants.items()):
+            for length in lengths:
+                for order, job in buckets[length]:
+                    inventoryFile.write('"{}",{},"{}"\n'.format(name, round(length, 4), job))
+
+class ReportPipeline:
+    """Parse, cost join and multing for one job. Each stage runs the first time something asks for it."""
+    def __init__(self, tgdFileNames, icbtFileNames=[], workers=1, estimateDrop=False):
+        self.tgdFileNames = tgdFileNames
+        self.icbtFileNames = icbtFileNames
+        self.workers = workers
+        self.estimateDrop = estimateDrop
+        self.takeOffs = None
+        self.stagesRun = []
+        self.timings = {}
+
+    def runStage(self, stage, function):
+        start = time.perf_counter()
+        function()
+        self.timings[stage] = time.perf_counter() - start
+        self.stagesRun.append(stage)
+
+    def parsed(self):
+        if 'parsed' not in self.stagesRun:
+            def parse():
+                if len(self.tgdFileNames) == 1:
+                    self.takeOffs = tgdRead(openInput(self.tgdFileNames[0]))
+                else:
+                    self.takeOffs = tgdReadFiles(self.tgdFileNames, self.workers)
+            self.runStage('parsed', parse)
+        return self.takeOffs
+
+    def joined(self):
+        if 'joined' not in self.stagesRun:
+            self.parsed()
+            def join():
+                # Cost rows add onto the shared index, so the files are joined one after another
+                for icbtFileName in self.icbtFileNames:
+                    self.takeOffs = icbtRead(openInput(icbtFileName), self.takeOffs)
+                if self.icbtFileNames:
+                    # Before nominal weights fill the gaps, so missing cost weight shows up too
+                    self.takeOffs['reconciliation'] = reconcileWeights(self.takeOffs['materialList'])
+                else:
+                    diagnostic('NOTE', 'no-cost-report', 'No Item Cost by Type file; weights are from the nominal shape table.')
+                self.takeOffs = applyShapeWeights(self.takeOffs)
+            self.runStage('joined', join)
+        return self.takeOffs
+
+    def multed(self):
+        if 'multed' not in self.stagesRun:
+            self.joined()
+            def mult():
+                if self.estimateDrop:
+                    self.takeOffs['materialList'] = multingEstimate(self.takeOffs['materialList'])
+                else:
+                    self.takeOffs['materialList'] = multing(self.takeOffs['materialList'])
+            self.runStage('multed', mult)
+        return self.takeOffs
+
+    def stage(self, stage):
+        return getattr(self, stage)()
+
+DIAGNOSTICS = Diagnostics()
+
 # FUNCTIONS
 
 def createColDict(colNames):
@@ -169,11 +585,203 @@ def nameClean(name):
     return name.rstrip()
 
 
+def diagnostic(level, code, message, **fields):
+    """Record a warning (level 'WARN') or note ('NOTE') under a stable code, eg. 'duplicate-entry'."""
+    DIAGNOSTICS.add(level, code, message, **fields)
+
+
+def shapeKey(name):
+    """Lookup key for a canonical shape name: upper case, no trailing period (eg. 'Pipe 6 Std.' -> 'PIPE 6 STD')."""
+    return name.upper().rstrip('.').strip()
+
+
+def shapeDimension(text):
+    """'3-1/2' -> 3.5, '3/8' -> 0.375, '0.280' -> 0.28"""
+    import fractions
+    if '-' in text:
+        whole, part = text.split('-')
+        return float(whole) + float(fractions.Fraction(part))
+    return float(fractions.Fraction(text))
+
+
+def shapeDimensionName(text):
+    """Dimension as nameClean leaves it: complex fractions become decimals (3-1/2 -> 3.5), the rest stay as written."""
+    if '-' in text:
+        return str(shapeDimension(text))
+    return text
+
+
+def buildShapeRecords():
+    """Generate {canonical name: nominal lb/ft} for every shape in the SHAPE_* size lists."""
+    records = {}
+    for prefix, sizes in (('W', SHAPE_W), ('C', SHAPE_C), ('MC', SHAPE_MC)):
+        for depth, weights in sizes.items():
+            for weight in weights:
+                records['{} {}x{}'.format(prefix, depth, weight)] = float(weight)
+
+    for legOne, legTwo, thinnest, thickest in SHAPE_L:
+        b1, b2 = shapeDimension(legOne), shapeDimension(legTwo)
+        for wall in SHAPE_WALLS[SHAPE_WALLS.index(thinnest):SHAPE_WALLS.index(thickest)+1]:
+            t = shapeDimension(wall)
+            name = 'L {}x{}x{}'.format(shapeDimensionName(legOne), shapeDimensionName(legTwo), shapeDimensionName(wall))
+            records[name] = STEEL_LB_PER_IN2_FT * t * (b1 + b2 - t)
+
+    # Rectangular HSS, outside corner radius 2t
+    for height, width, thinnest, thickest in SHAPE_HSS_RECT:
+        h, b = shapeDimension(height), shapeDimension(width)
+        for wall in SHAPE_WALLS[SHAPE_WALLS.index(thinnest):SHAPE_WALLS.index(thickest)+1]:
+            t = shapeDimension(wall)
+            area = 2 * t * (h + b - 2 * t) - (4 - math.pi) * 3 * t * t
+            name = 'HSS {}x{}x{}'.format(shapeDimensionName(height), shapeDimensionName(width), shapeDimensionName(wall))
+            records[name] = STEEL_LB_PER_IN2_FT * area
+
+    for diameter, walls in SHAPE_HSS_ROUND.items():
+        for wall in walls:
+            d, t = float(diameter), float(wall)
+            records['HSS {}x{}'.format(diameter, wall)] = STEEL_LB_PER_IN2_FT * math.pi * (d - t) * t
+
+    for size, (d, std, xs, xxs) in SHAPE_PIPE.items():
+        for grade, t in (('Std', std), ('XS', xs), ('XXS', xxs)):
+            if t:
+                records['Pipe {} {}'.format(size, grade)] = STEEL_LB_PER_IN2_FT * math.pi * (d - t) * t
+
+    return records
+
+
+def writeShapeTable(fileName=SHAPE_TABLE_FILE):
+    """Write the shape records as an open-addressing hash table (crc32, linear probing) that can be mmapped as is."""
+    records = buildShapeRecords()
+    slotCount = 1
+    while slotCount < 2 * len(records):
+        slotCount *= 2
+
+    slots = [None] * slotCount
+    for name, weight in records.items():
+        key = shapeKey(name).encode('ascii')
+        slot = zlib.crc32(key) % slotCount
+        while slots[slot] is not None:
+            slot = (slot + 1) % slotCount
+        slots[slot] = (key, round(weight, 2))
+
+    with open(fileName, 'wb') as shapeFile:
+        shapeFile.write(SHAPE_HEADER.pack(SHAPE_MAGIC, slotCount, len(records)))
+        for entry in slots:
+            shapeFile.write(SHAPE_SLOT.pack(*entry) if entry else SHAPE_SLOT.pack(b'', 0.0))
+
+
+def loadShapeTable():
+    """Map the shape table on first use. Returns (buffer, slot count), or None if the file is missing or bad.
+    Run from a zip bundle, the table is read out of the archive instead, as there is no file to map."""
+    global SHAPE_TABLE
+    if SHAPE_TABLE is None:
+        SHAPE_TABLE = False
+        buffer = None
+        if os.path.exists(SHAPE_TABLE_FILE):
+            with open(SHAPE_TABLE_FILE, 'rb') as shapeFile:
+                buffer = mmap.mmap(shapeFile.fileno(), 0, access=mmap.ACCESS_READ)
+        elif hasattr(__loader__, 'archive'):
+            try:
+                buffer = __loader__.get_data(os.path.basename(SHAPE_TABLE_FILE))
+            except OSError:
+                pass
+        if buffer is not None:
+            magic, slotCount, recordCount = SHAPE_HEADER.unpack_from(buffer, 0)
+            if magic == SHAPE_MAGIC:
+                SHAPE_TABLE = (buffer, slotCount)
+            else:
+                diagnostic('WARN', 'shape-table', SHAPE_TABLE_FILE+' is not a shape table; nominal weights unavailable.')
+    return SHAPE_TABLE or None
+
+
+def shapeWeightPerFoot(name):
+    """Nominal lb/ft for a canonical shape name, or 0 if the shape is not in the table."""
+    table = loadShapeTable()
+    if not table:
+        return 0
+    buffer, slotCount = table
+    key = shapeKey(name).encode('ascii', 'replace')
+    slot = zlib.crc32(key) % slotCount
+    for probe in range(slotCount):
+        slotName, weight = SHAPE_SLOT.unpack_from(buffer, SHAPE_HEADER.size + slot * SHAPE_SLOT.size)
+        slotName = slotName.rstrip(b'\0')
+        if not slotName:
+            return 0
+        if slotName == key:
+            return round(weight, 2)
+        slot = (slot + 1) % slotCount
+    return 0
+
+
+def applyShapeWeights(takeOffs):
+    """Fill in weights the cost report did not supply from nominal lb/ft: materials with no weight per foot,
+    and struct takeoffs with LF but no weight."""
+    for materialName, mat in takeOffs['materialList'].items():
+        if not mat.weightPerFoot:
+            weightPerFoot = shapeWeightPerFoot(materialName)
+            if weightPerFoot:
+                mat.weightPerFoot = weightPerFoot
+                if not mat.weight:
+                    mat.weight = mat.lf * weightPerFoot
+                    diagnostic('NOTE', 'nominal-weight', materialName+' weight is from the nominal shape table ('+'%.2f' % weightPerFoot+' lb/ft).',
+                        name=materialName, weightPerFoot=weightPerFoot)
+
+    for index, tf in takeOffs['struct'].items():
+        if not tf.weight and tf.lf:
+            weightPerFoot = shapeWeightPerFoot(deStubString(tf.name, STUB_LIST))
+            tf.weight = tf.lf * weightPerFoot
+            if not weightPerFoot:
+                diagnostic('WARN', 'unknown-weight', tf.name+' is not in the cost report or the shape table; its weight could not be determined.',
+                    name=tf.name)
+
+    return takeOffs
+
+
+def popFlag(args, flag):
+    """Remove a bare '--flag' from args and return whether it was present."""
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+
+def popOption(args, flag, default=None):
+    """Remove a '--flag value' pair from args and return the value (or default if the flag is absent)."""
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 >= len(args):
+            print('ERROR: '+flag+' requires a value')
+            exit(1)
+        value = args[i+1]
+        del args[i:i+2]
+        return value
+    return default
+
+
+def popIntOption(args, flag, default, minimum=0):
+    """popOption for a whole number of at least minimum."""
+    value = popOption(args, flag, default)
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        print('ERROR: '+flag+' needs a whole number of at least '+str(minimum))
+        exit(1)
+    return value
+
+
+def indexPlan(takeOffs, plan, listing, index):
+    """Record that takeOffs[listing][index] belongs to plan, so a plan's takeoffs can be pulled without a scan."""
+    if plan not in takeOffs['plans']:
+        takeOffs['plans'][plan] = {'struct': [], 'deck': [], 'cxn': []}
+    takeOffs['plans'][plan][listing].append(index)
+
+
 def tgdRead(tgdFile):
     """Read Takeoff Geomoetry Detail File (Items)"""
     
     colDict = {}
-    takeOffs = {'struct': {}, 'deck': {}, 'cxn': {}, 'materialList': {}}
+    takeOffs = {'struct': {}, 'deck': {}, 'cxn': {}, 'materialList': {}, 'plans': {}}
     firstLine = 1
     tf = Takeoff()
     materialName = ''
@@ -222,12 +830,13 @@ def tgdRead(tgdFile):
 
             # Type 'None' encountered
             if data[colDict['Type']] == 'None':
-                MESSAGE_OUTPUT.append("WARN: Type of 'None' encountered: "
+                diagnostic('WARN', 'type-none', "Type of 'None' encountered: "
                     +data[colDict['Plan Name']]+" | "
                     +data[colDict['Type']]+" | "
                     +data[colDict['EA']]+" | "
                     +data[colDict['Name']]+" | "
-                    +data[colDict['Description']]
+                    +data[colDict['Description']],
+                    plan=data[colDict['Plan Name']], name=data[colDict['Name']]
                 )
 
             # If we already have this index, don't create a new Takeoff. The name, description, and index variables remain unchanged,
@@ -235,7 +844,8 @@ def tgdRead(tgdFile):
             if index in takeOffs[listing]:
                 tf.count += int(data[colDict['EA']])
                 if takeOffs[listing][index].rawName == rawName:
-                    MESSAGE_OUTPUT.append("WARN: Duplicate entry of "+index+" in Takeoff Geometry Detail. Unedited Name is "+rawName)
+                    diagnostic('WARN', 'duplicate-entry', "Duplicate entry of "+index+" in Takeoff Geometry Detail. Unedited Name is "+rawName,
+                        index=index, rawName=rawName)
 
             else:
 
@@ -244,7 +854,7 @@ def tgdRead(tgdFile):
                 if name.split():
                     lastName = name.split()[-1]
                 if lastName in STUB_LIST:
-                    #MESSAGE_OUTPUT.append("NOTE: "+name+" were included as stubs. Their lengths, lineal footage, and weight are included in the more generic "+deStubString(name)+" listing; their counts are not.")
+                    #diagnostic('NOTE', 'stub', name+" were included as stubs. Their lengths, lineal footage, and weight are included in the more generic "+deStubString(name)+" listing; their counts are not.")
     
                     indexStub = index
                     index = deStubString(index, STUB_LIST)
@@ -259,6 +869,7 @@ def tgdRead(tgdFile):
                         int(data[colDict['EA']])
                     )
                     takeOffs[listing][indexStub] = tfStub
+                    indexPlan(takeOffs, tfStub.plan, listing, indexStub)
                     nameDeStubbed = deStubString(name, STUB_LIST)
 
                     if nameDeStubbed in takeOffs['materialList']:
@@ -294,6 +905,7 @@ def tgdRead(tgdFile):
                     tf.dnl = dnl
                     tf.rowCount = tfRowCount
                     takeOffs[listing][index] = tf
+                    indexPlan(takeOffs, tf.plan, listing, index)
 
                     # reset dnl, rowCount
                     dnl = ''
@@ -328,11 +940,13 @@ def tgdRead(tgdFile):
                     tf.lengths.append(float(descriptionAsNum))
                     tf.lf += float(descriptionAsNum)
                     mat.lf += float(descriptionAsNum)
+                    mat.indexLength(float(descriptionAsNum))
 
             # All other types
             elif (not isBlank(lfEntry)) and (float(lfEntry) != 0):
                 tf.lengths.append(float(lfEntry))
                 mat.lf += float(lfEntry)
+                mat.indexLength(float(lfEntry))
 
             mat.takeOffList[index] = tf
             takeOffs['materialList'][materialName] = mat
@@ -340,6 +954,139 @@ def tgdRead(tgdFile):
     return takeOffs
 
 
+def tgdReadPart(tgdFileName):
+    """tgdRead one file, returning its takeOffs and the messages it raised. Runs in a worker process when parallel."""
+    global DIAGNOSTICS
+    outer = DIAGNOSTICS
+    DIAGNOSTICS = Diagnostics(cap=outer.cap)
+    try:
+        takeOffs = tgdRead(openInput(tgdFileName))
+        return takeOffs, DIAGNOSTICS.export()
+    finally:
+        DIAGNOSTICS = outer
+
+
+def mergeTakeOffs(takeOffs, part, partName):
+    """Merge one file's takeOffs into the shared index. A Plan|Type|Name already present gets the part's counts and
+    lengths added, and the duplicate-entry warning if the unedited names match, as within a single file."""
+    merged = {} # id of a part Takeoff -> the shared Takeoff it went into
+    for listing in ['struct', 'deck', 'cxn']:
+        for index, tf in part[listing].items():
+            if index in takeOffs[listing]:
+                shared = takeOffs[listing][index]
+                shared.merge(tf)
+                if shared.rawName == tf.rawName:
+                    diagnostic('WARN', 'duplicate-entry', "Duplicate entry of "+index+" in Takeoff Geometry Detail ("+partName+"). Unedited Name is "+tf.rawName,
+                        index=index, rawName=tf.rawName, file=partName)
+                merged[id(tf)] = shared
+            else:
+                takeOffs[listing][index] = tf
+                indexPlan(takeOffs, tf.plan, listing, index)
+                merged[id(tf)] = tf
+
+    for materialName, partMat in part['materialList'].items():
+        if materialName not in takeOffs['materialList']:
+            mat = Material(materialName, {})
+            takeOffs['materialList'][materialName] = mat
+        mat = takeOffs['materialList'][materialName]
+        mat.lf += partMat.lf
+        mat.mergeIndex(partMat)
+        for index, tf in partMat.takeOffList.items():
+            if id(tf) in merged:
+                mat.takeOffList[index] = merged[id(tf)]
+            elif index in mat.takeOffList:
+                mat.takeOffList[index].merge(tf)
+                merged[id(tf)] = mat.takeOffList[index]
+            else:
+                mat.takeOffList[index] = tf
+                merged[id(tf)] = tf
+
+    return takeOffs
+
+
+def tgdReadFiles(tgdFileNames, workers=1):
+    """Read several Takeoff Geometry Detail files (eg. one per phase) into one takeOffs index.
+
+    Files are parsed concurrently when workers > 1, then merged in the order given, each part released as soon
+    as it is merged. Only `workers` files are submitted ahead of the merge, so memory follows the distinct
+    takeoffs and the worker count rather than the number of files."""
+    takeOffs = {'struct': {}, 'deck': {}, 'cxn': {}, 'materialList': {}, 'plans': {}}
+    if workers > 1 and '-' not in tgdFileNames: # stdin can only be read in this process
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+        def submitted():
+            remaining = iter(tgdFileNames)
+            pending = collections.deque(executor.submit(tgdReadPart, name) for name in itertools.islice(remaining, workers))
+            while pending:
+                part = pending.popleft().result()
+                for name in itertools.islice(remaining, 1):
+                    pending.append(executor.submit(tgdReadPart, name))
+                yield part
+
+        parts = submitted()
+    else:
+        executor = None
+        parts = map(tgdReadPart, tgdFileNames)
+
+    for tgdFileName, (part, messages) in zip(tgdFileNames, parts):
+        DIAGNOSTICS.absorb(messages)
+        takeOffs = mergeTakeOffs(takeOffs, part, os.path.basename(tgdFileName))
+
+    if executor:
+        executor.shutdown()
+    return takeOffs
+
+
+def openInput(fileName):
+    """Open an export for reading lines. gzip, bz2, xz and (with the zstandard module) zstd are decoded as they
+    are read, recognized by their magic bytes rather than the extension. '-' is stdin."""
+    global STDIN_INPUT
+    if fileName == '-':
+        if STDIN_INPUT is None:
+            STDIN_INPUT = io.TextIOWrapper(decompressInput(sys.stdin.buffer))
+        return STDIN_INPUT
+    return io.TextIOWrapper(decompressInput(open(fileName, 'rb')))
+
+
+def decompressInput(binaryFile):
+    """Wrap a buffered binary stream in the decoder its first bytes call for, if any."""
+    magic = binaryFile.peek(6)
+    for prefix, codec in COMPRESSION_MAGIC:
+        if not magic.startswith(prefix):
+            continue
+        if codec == 'gzip':
+            import gzip
+            return gzip.GzipFile(fileobj=binaryFile)
+        if codec == 'bz2':
+            import bz2
+            return bz2.BZ2File(binaryFile)
+        if codec == 'xz':
+            import lzma
+            return lzma.LZMAFile(binaryFile)
+        try:
+            import zstandard
+        except ImportError:
+            print('ERROR: zstd input needs the zstandard module (pip install zstandard)')
+            exit(1)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(binaryFile))
+    return binaryFile
+
+
+def isIcbtFile(fileName):
+    """Item Cost by Type exports start with a line that only has 'Material' in the first cell."""
+    global STDIN_INPUT
+    if fileName == '-':
+        # stdin can't be reopened, so the line read here is put back in front of the rest
+        inputFile = openInput(fileName)
+        firstLine = inputFile.readline()
+        STDIN_INPUT = itertools.chain([firstLine], inputFile)
+    else:
+        with openInput(fileName) as inputFile:
+            firstLine = inputFile.readline()
+    return firstLine.strip().split(',')[0].strip('\"') == 'Material'
+
+
 def icbtRead(icbtFile, takeOffs):
     """Read Item Cost by Type File (Cost)"""
     
@@ -399,9 +1146,11 @@ def icbtRead(icbtFile, takeOffs):
             tf.dnl = 'DNL'
             tf.rowCount = 1
             takeOffs['struct'][index] = tf
+            indexPlan(takeOffs, tf.plan, 'struct', index)
 
             if tf.name.startswith('HSS') and ( tf.typeName == 'Beam' or tf.typeName == 'Column' ):
-                MESSAGE_OUTPUT.append(tf.name+' ('+tf.typeName+') was added in the cost report. This might be an item not found in STACK (eg. HSS 7x3x1/4 -> HSS 6x4x1/4), or a pipe column.')
+                diagnostic('WARN', 'cost-only-hss', tf.name+' ('+tf.typeName+') was added in the cost report. This might be an item not found in STACK (eg. HSS 7x3x1/4 -> HSS 6x4x1/4), or a pipe column.',
+                    name=tf.name, type=tf.typeName)
 
         # This has an entry in material list:
         if name in takeOffs['materialList']:
@@ -416,88 +1165,886 @@ def icbtRead(icbtFile, takeOffs):
         # Or it's new in the cost report:
         else:
             pass
-#            MESSAGE_OUTPUT.append(tf.name+' was added to the material list from the cost report.')
+#            diagnostic('NOTE', 'cost-only-material', tf.name+' was added to the material list from the cost report.')
 
     return takeOffs
 
 
-def multing(materialList):
+def reconcileWeights(materialList, tolerance=RECONCILE_TOLERANCE):
+    """Check cost report weight against TGD LF times nominal lb/ft for every material with a known shape.
+
+    One pass gathers the LF, cost weight and nominal lb/ft columns; the comparisons then run column-wise. Returns
+    the mismatches, worst first, as (name, lf, weight, cost lb/ft, nominal lb/ft, ratio) rows."""
+    names = []
+    lfs = array.array('d')
+    weights = array.array('d')
+    nominals = array.array('d')
+    for materialName, mat in materialList.items():
+        nominal = shapeWeightPerFoot(materialName)
+        if nominal and mat.lf:
+            names.append(materialName)
+            lfs.append(mat.lf)
+            weights.append(mat.weight)
+            nominals.append(nominal)
+
+    implied = [weight / lf for weight, lf in zip(weights, lfs)]
+    ratios = [perFoot / nominal for perFoot, nominal in zip(implied, nominals)]
+    mismatches = [i for i, ratio in enumerate(ratios) if abs(ratio - 1) > tolerance]
+    mismatches.sort(key=lambda i: -abs(ratios[i] - 1))
+
+    return [(names[i], lfs[i], weights[i], implied[i], nominals[i], ratios[i]) for i in mismatches]
+
+
+def lengthRuns(lengthList):
+    """Group a sorted length list into [length, count] runs, keeping the sort order."""
+    runs = []
+    for length in lengthList:
+        if runs and runs[-1][0] == length:
+            runs[-1][1] += 1
+        else:
+            runs.append([length, 1])
+    return runs
+
+
+def multRuns(runs, maxLen=MAX_STOCK, kerf=KERF):
+    """Next-fit multing over [length, count] runs (longest first).
+
+    Produces the same bars as placing the pieces one at a time, but a run of identical pieces is placed a whole
+    stock length at a time. Identical bars are collapsed into patterns: {'pieces': ((length, count), ...),
+    'count', 'used'}, in the order they were first cut. Also returns the range [validFrom, validTo) of maximum
+    stock lengths for which every fit decision, and so the result, would come out the same."""
+    dropLength = 0
+    bars = 0
+    used = 0
+    isOpen = False
+    barPieces = []
+    patterns = {}
+    validFrom = 0
+    validTo = math.inf
+
+    def addPattern(pieces, used, count):
+        key = tuple(tuple(piece) for piece in pieces)
+        if key in patterns:
+            patterns[key]['count'] += count
+        else:
+            patterns[key] = {'pieces': key, 'count': count, 'used': used}
+
+    for length, count in runs:
+
+        # Longer than stock: close the current bar, every piece gets its own bar
+        if length > maxLen:
+            validTo = min(validTo, length)
+            if isOpen:
+                dropLength += math.ceil(float(used/5))*5 - used
+                bars += 1
+                addPattern(barPieces, used, 1)
+                isOpen = False
+                used = 0
+            barDrop = math.ceil(float(length/5))*5 - length
+            for i in range(count):
+                dropLength += barDrop
+            bars += count
+            addPattern([[length, 1]], length, count)
+            continue
+
+        validFrom = max(validFrom, length)
+        remaining = count
+
+        # Top off the current bar
+        added = 0
+        while remaining and used != 0:
+            fit = used + kerf + length
+            if fit > maxLen:
+                validTo = min(validTo, fit)
+                break
+            validFrom = max(validFrom, fit)
+            used = fit
+            remaining -= 1
+            added += 1
+        if added:
+            barPieces.append([length, added])
+        if not remaining:
+            continue
+
+        # Fill one fresh bar to find how many of this length fit, keeping the running sums
+        sums = [length]
+        while len(sums) < remaining and sums[-1] != 0:
+            fit = sums[-1] + kerf + length
+            if fit > maxLen:
+                validTo = min(validTo, fit)
+                break
+            validFrom = max(validFrom, fit)
+            sums.append(fit)
+
+        fullBars, leftover = divmod(remaining, len(sums))
+        if leftover:
+            lastUsed = sums[leftover - 1]
+        else:
+            fullBars -= 1
+            leftover = len(sums)
+            lastUsed = sums[-1]
+
+        if isOpen:
+            dropLength += math.ceil(float(used/5))*5 - used
+            bars += 1
+            addPattern(barPieces, used, 1)
+        barDrop = math.ceil(float(sums[-1]/5))*5 - sums[-1]
+        for i in range(fullBars):
+            dropLength += barDrop
+        bars += fullBars
+        if fullBars:
+            addPattern([[length, len(sums)]], sums[-1], fullBars)
+        used = lastUsed
+        barPieces = [[length, leftover]]
+        isOpen = True
+
+    if isOpen:
+        dropLength += math.ceil(float(used/5))*5 - used
+        bars += 1
+        addPattern(barPieces, used, 1)
+
+    return {'dropLength': dropLength, 'bars': bars, 'patterns': list(patterns.values()), 'validFrom': validFrom, 'validTo': validTo}
+
+
+def multingBounds(lengthList, maxLen=MAX_STOCK, kerf=KERF):
+    """Lower bounds on the bar count for a length list sorted longest first. Returns (L1, L2).
+
+    A bar holds pieces whose lengths plus one kerf each fit in maxLen + kerf, so the bounds are taken over
+    those sizes. Pieces longer than stock always need a bar of their own. L1 is the total size over the
+    capacity; L2 is the Martello-Toth bound, found with one pass over the sorted sizes."""
+    capacity = maxLen + kerf
+    longCount = 0
+    sizes = []
+    for length in lengthList:
+        if length > maxLen:
+            longCount += 1
+        else:
+            sizes.append(length + kerf)
+    if not sizes:
+        return longCount, longCount
+
+    # Prefix sums over the (descending) sizes
+    prefix = [0.0]
+    for size in sizes:
+        prefix.append(prefix[-1] + size)
+
+    l1 = longCount + math.ceil(prefix[-1] / capacity - 1e-9)
+
+    half = capacity / 2
+    bigCount = 0 # sizes > capacity / 2
+    while bigCount < len(sizes) and sizes[bigCount] > half:
+        bigCount += 1
+
+    # Walk alpha up through the small sizes (from the end of the list); J1 grows from the front as alpha rises
+    best = 0
+    j1Count = 0
+    smallEnd = len(sizes)
+    alphas = [0] + [sizes[i] for i in range(len(sizes) - 1, bigCount - 1, -1)]
+    for alpha in alphas:
+        while smallEnd > bigCount and sizes[smallEnd - 1] < alpha:
+            smallEnd -= 1
+        while j1Count < bigCount and sizes[j1Count] > capacity - alpha:
+            j1Count += 1
+        j2Count = bigCount - j1Count
+        j2Slack = j2Count * capacity - (prefix[bigCount] - prefix[j1Count])
+        j3Sum = prefix[smallEnd] - prefix[bigCount]
+        bound = j1Count + j2Count + max(0, math.ceil((j3Sum - j2Slack) / capacity - 1e-9))
+        best = max(best, bound)
+
+    return l1, longCount + max(best, l1 - longCount)
+
+
+def multing(materialList, maxLen=MAX_STOCK, kerf=KERF):
     """Change LF and weight using lengths and multing heuristics"""
-    maxLen = MAX_STOCK
-    kerf = KERF
     for materialName, mat in materialList.items():
-        first = True
-        overallStockList = []
-        singleStockList = []
-        dropList = []
         lengthList = mat.produceLengthList()
+        start = time.perf_counter()
+        mult = multRuns(lengthRuns(lengthList), maxLen, kerf)
+        mat.multSeconds = time.perf_counter() - start
+        mat.dropLength = mult['dropLength']
+        mat.dropWeight = mat.weightPerFoot*mult['dropLength']
+        mat.pieces = len(lengthList)
+        mat.bars = mult['bars']
+        mat.cutPatterns = mult['patterns']
+        mat.barsLowerBound, mat.barsL2 = multingBounds(lengthList, maxLen, kerf)
+
+    return materialList
 
-        # singleStockList describes the pieces that fit within one maximum stock length (eg. 65'),
-        # overallStockList is a list of singleStockLists. Flattened, it would look like our original lengthList. 
 
-        for length in lengthList:
+def feetInches(length):
+    """Decimal feet to a shop dimension to the nearest 1/16": 12.3 -> 12' 3-5/8\""""
+    sixteenths = int(round(length * 12 * 16))
+    feet, sixteenths = divmod(sixteenths, 12 * 16)
+    inches, sixteenths = divmod(sixteenths, 16)
+    text = "{}' {}".format(feet, inches)
+    if sixteenths:
+        divisor = math.gcd(sixteenths, 16)
+        text = text+'-{}/{}'.format(sixteenths // divisor, 16 // divisor)
+    return text+'"'
+
+
+def writeCutTickets(cutFile, patternsByPlan):
+    """Write one cut ticket row per bar pattern. patternsByPlan is {plan: {materialName: patterns}}."""
+    cutFile.write('Plan,Material,Pattern,Bars,Stock Length,Cuts,Drop\n')
+    for plan, patternsByMaterial in patternsByPlan.items():
+        for materialName, patterns in patternsByMaterial.items():
+            for number, pattern in enumerate(patterns, 1):
+                stockLength = math.ceil(float(pattern['used']/5))*5
+                cuts = ' + '.join('{} @ {}'.format(count, feetInches(length)) for length, count in pattern['pieces'])
+                cutFile.write('"{}","{}",{},{},{},"{}","{}"\n'.format(
+                    plan,
+                    materialName,
+                    re.sub(r' ', '', materialName)+'-'+str(number),
+                    pattern['count'],
+                    "{}'".format(stockLength),
+                    cuts.replace('"', '""'),
+                    feetInches(stockLength - pattern['used']).replace('"', '""'),
+                ))
+
+
+def multingEstimate(materialList, maxLen=MAX_STOCK, kerf=KERF):
+    """Estimate each material's drop from its exact-length index instead of multing every piece. Sets dropWeight
+    like multing() does.
+
+    multing() fills whole bars with identical lengths wherever a length repeats, so for each distinct length the
+    closed full bars and their drop follow directly from the histogram. Only the leftover pieces
+    (at most a bar's worth per length) are actually mult. The estimate differs from multing() only in which
+    pieces end up in those mixed bars. The low / high range is a heuristic band, not a confidence interval: it
+    treats each mixed bar's drop as uniform over one 5' stock increment and widens by 1.96 standard deviations.
+    No cut patterns or bar counts are produced. Work depends on the number of distinct lengths, not on the
+    piece count."""
+    for materialName, mat in materialList.items():
+        histogram = mat.lengthCounts
+        mat.pieces = sum(histogram.values())
+
+        dropLength = 0.0
+        leftovers = []
+        for length in sorted(histogram, reverse=True):
+            count = histogram[length]
             if length > maxLen:
+                dropLength += count * (math.ceil(float(length/5))*5 - length)
+                continue
+            sums = [length]
+            while len(sums) < count and sums[-1] != 0 and sums[-1] + kerf + length <= maxLen:
+                sums.append(sums[-1] + kerf + length)
+            # The last bar of a length stays open for shorter pieces, so it is always left to the mixed bars
+            fullBars = (count - 1) // len(sums)
+            dropLength += fullBars * (math.ceil(float(sums[-1]/5))*5 - sums[-1])
+            leftovers.append([length, count - fullBars*len(sums)])
+
+        mixed = multRuns(leftovers, maxLen, kerf)
+        mat.dropLength = dropLength + mixed['dropLength']
+        mat.dropWeight = mat.weightPerFoot*mat.dropLength
+        spread = 1.96 * (5 / math.sqrt(12)) * math.sqrt(mixed['bars'])
+        mat.dropEstimate = (
+            mixed['bars'],
+            mat.weightPerFoot * max(0, mat.dropLength - spread),
+            mat.weightPerFoot * (mat.dropLength + spread),
+        )
 
-                if sum(singleStockList) > 0:
-                    overallStockList.append(singleStockList)
-                    singleStockList = []
-                overallStockList.append([length])
+    return materialList
 
-            elif sum(singleStockList) == 0: # empty list, no kerf. Add length to Single, add to Overall.
-                singleStockList = [length] # new singleList
-                overallStockList.append(singleStockList)
 
-            elif sum(singleStockList) + kerf + length > maxLen: # can't add, would be too long
-                oldOverall = overallStockList.copy()
-                singleStockList = [length] # new singleList
-                overallStockList.append(singleStockList) # put in OSL
+def printDropEstimate(materialList):
+    """Print each material's estimated drop with its heuristic low / high range."""
+    print('\t'.join(['Drop Estimate', 'Pieces', 'Mixed Bars', 'Drop LF', 'Drop Weight', 'Range Low', 'Range High']))
+    for materialName, mat in materialList.items():
+        if not mat.pieces:
+            continue
+        mixedBars, low, high = mat.dropEstimate
+        print('\t'.join([
+            materialName,
+            str(mat.pieces),
+            str(mixedBars),
+            '%.2f' % mat.dropLength,
+            '%.2f' % mat.dropWeight,
+            '%.2f' % low,
+            '%.2f' % high,
+        ]))
+
+
+def printLengthQuery(materialList, query):
+    """Answer a --query from the materials' length indexes alone: 'summary' gives pieces, LF, shortest and longest
+    per material, 'distribution' the pieces per length bucket."""
+    if query == 'summary':
+        print('\t'.join(['Lengths', 'Pieces', 'LF', 'Shortest', 'Longest', 'Buckets']))
+        for materialName, mat in materialList.items():
+            if not mat.lengthIndex:
+                continue
+            print('\t'.join([
+                materialName,
+                str(mat.indexedPieces()),
+                '%.2f' % mat.lf,
+                feetInches(mat.shortest),
+                feetInches(mat.longest),
+                str(len(mat.lengthIndex)),
+            ]))
+    else:
+        print('\t'.join(['Lengths', 'Length', 'Pieces']))
+        for materialName, mat in materialList.items():
+            for length in sorted(mat.lengthIndex, reverse=True):
+                print('\t'.join([materialName, feetInches(length), str(mat.lengthIndex[length])]))
+
+
+def printMultingQuality(materialList):
+    """Print achieved bars and drop next to the bar-count lower bounds, so heuristic loss is visible."""
+    print('\t'.join(['Multing', 'Pieces', 'Bars', 'Bars LB (L1)', 'Bars LB (L2)', 'Gap', 'Drop LF', 'Drop Weight', 'Seconds']))
+    for materialName, mat in materialList.items():
+        if not mat.pieces:
+            continue
+        print('\t'.join([
+            materialName,
+            str(mat.pieces),
+            str(mat.bars),
+            str(mat.barsLowerBound),
+            str(mat.barsL2),
+            str(mat.bars - mat.barsL2),
+            '%.2f' % mat.dropLength,
+            '%.2f' % mat.dropWeight,
+            '%.6f' % mat.multSeconds,
+        ]))
+
+
+def printReconciliation(takeOffs):
+    """Print the cost report weights that disagree with TGD LF at nominal lb/ft. Nothing when all agree."""
+    mismatches = takeOffs.get('reconciliation', [])
+    if not mismatches:
+        return
+    print('')
+    print('\t'.join(['Reconcile', 'LF', 'Cost Weight', 'Cost lb/ft', 'Nominal lb/ft', 'Off']))
+    for name, lf, weight, perFoot, nominal, ratio in mismatches:
+        print('\t'.join([
+            name,
+            '%.2f' % lf,
+            '%.2f' % weight,
+            '%.2f' % perFoot,
+            '%.2f' % nominal,
+            '%+.1f%%' % (100 * (ratio - 1)),
+        ]))
+
+
+def jointMulting(jobs, inventory, maxLen=MAX_STOCK, kerf=KERF):
+    """Mult each canonical material across several jobs at once, using remnants before new stock.
+
+    jobs maps a job name to its takeOffs. Each piece first takes the best-fitting remnant from the inventory;
+    everything else is next-fit onto new bars. Drops of at least REMNANT_MIN_LENGTH go back into the inventory,
+    shorter ones are scrap. Scrap is attributed to jobs by their share of the bar (or remnant) it came from.
+    Returns {materialName: {jobName: {'pieces', 'fromRemnants', 'scrapLength'}}} and the bar count per material."""
+    piecesByMaterial = {}
+    for jobName, takeOffs in jobs.items():
+        for materialName, mat in takeOffs['materialList'].items():
+            pieces = piecesByMaterial.setdefault(materialName, [])
+            pieces.extend((length, jobName) for length in mat.produceLengthList())
+
+    attribution = {}
+    barCounts = {}
+    for materialName, pieces in piecesByMaterial.items():
+        pieces.sort(key=lambda piece: piece[0], reverse=True)
+        byJob = {}
+        for jobName in jobs:
+            byJob[jobName] = {'pieces': 0, 'fromRemnants': 0, 'scrapLength': 0.0}
+        barCounts[materialName] = 0
+        bar = []
+        used = 0
+
+        def closeBar(bar, used):
+            stockLength = math.ceil(float(used/5))*5
+            drop = stockLength - used
+            if drop - kerf >= REMNANT_MIN_LENGTH:
+                inventory.add(materialName, drop - kerf, '+'.join(sorted(set(job for length, job in bar))))
+                return
+            # Shared by piece length; kerfs belong to no job
+            pieceLength = sum(length for length, job in bar)
+            for length, job in bar:
+                byJob[job]['scrapLength'] += drop * length / pieceLength
+
+        for length, jobName in pieces:
+            byJob[jobName]['pieces'] += 1
+
+            # Remnants first
+            remnant = inventory.take(materialName, length)
+            if remnant is not None:
+                byJob[jobName]['fromRemnants'] += 1
+                leftover = remnant[0] - length - kerf
+                if leftover >= REMNANT_MIN_LENGTH:
+                    inventory.add(materialName, leftover, remnant[1])
+                elif leftover > 0:
+                    byJob[jobName]['scrapLength'] += leftover
+                continue
+
+            # New stock, same next-fit rule as multing()
+            if bar and used != 0 and used + kerf + length <= maxLen and length <= maxLen:
+                bar.append((length, jobName))
+                used = used + kerf + length
+            else:
+                if bar:
+                    closeBar(bar, used)
+                bar = [(length, jobName)]
+                used = length
+                barCounts[materialName] += 1
+
+        if bar:
+            closeBar(bar, used)
+        attribution[materialName] = byJob
+
+    return attribution, barCounts
+
+
+def printJointMulting(jobs, attribution, barCounts):
+    """Print per-material, per-job piece counts, remnant use and scrap weight, then per-job totals."""
+    print('\t'.join(['Material', 'Job', 'Pieces', 'From Remnants', 'Joint Bars', 'Scrap Weight']))
+    jobTotals = {}
+    for jobName in jobs:
+        jobTotals[jobName] = 0.0
+    for materialName, byJob in attribution.items():
+        weightPerFoot = 0
+        for jobName, takeOffs in jobs.items():
+            if materialName in takeOffs['materialList'] and takeOffs['materialList'][materialName].weightPerFoot:
+                weightPerFoot = takeOffs['materialList'][materialName].weightPerFoot
+                break
+        for jobName, counts in byJob.items():
+            if not counts['pieces']:
+                continue
+            scrapWeight = weightPerFoot * counts['scrapLength']
+            jobTotals[jobName] += scrapWeight
+            print('\t'.join([materialName, jobName, str(counts['pieces']), str(counts['fromRemnants']),
+                str(barCounts[materialName]), '%.2f' % scrapWeight]))
+    print('')
+    print('\t'.join(['Job', 'Scrap Weight']))
+    for jobName, scrapWeight in jobTotals.items():
+        print('\t'.join([jobName, '%.2f' % scrapWeight]))
 
-            else: # good to add
-                singleStockList.append(kerf)
-                singleStockList.append(length)
 
-        totalDropLength = 0
-        for singleStock in overallStockList:
-            stockLength = math.ceil(float(sum(singleStock)/5))*5
-            dropLength = stockLength - sum(singleStock)
-            totalDropLength = totalDropLength + dropLength
-        mat.dropWeight = mat.weightPerFoot*totalDropLength
+def multingSweep(materialList, maxLens, kerfs):
+    """Evaluate multing for every (max stock, kerf) pair. Returns {(maxLen, kerf): {materialName: dropLength}}.
 
-    return materialList
+    Length runs are built once per material. For each kerf the stock lengths are walked in ascending order,
+    and a result is reused for every following stock length that falls inside its valid range."""
+    runsByMaterial = {}
+    for materialName, mat in materialList.items():
+        runsByMaterial[materialName] = lengthRuns(mat.produceLengthList())
+
+    results = {}
+    for kerf in kerfs:
+        for maxLen in maxLens:
+            results[(maxLen, kerf)] = {}
+        for materialName, runs in runsByMaterial.items():
+            mult = None
+            for maxLen in sorted(maxLens):
+                if mult is None or not (mult['validFrom'] <= maxLen < mult['validTo']):
+                    mult = multRuns(runs, maxLen, kerf)
+                results[(maxLen, kerf)][materialName] = mult['dropLength']
+
+    return results
+
+
+def parseSweepValues(text):
+    """Parse a sweep list like '60,65' or an inclusive range like '40:65:5' into floats."""
+    values = []
+    for part in text.split(','):
+        if isBlank(part):
+            continue
+        try:
+            numbers = [float(i) for i in part.split(':')]
+        except ValueError:
+            numbers = []
+        if len(numbers) == 1:
+            values.append(numbers[0])
+            continue
+        if len(numbers) != 3:
+            print('ERROR: bad sweep value '+part+'; expected numbers like 60,65 or 40:65:5')
+            exit(1)
+        start, stop, step = numbers
+        if step <= 0 or stop < start:
+            print('ERROR: bad sweep range '+part+'; expected start:stop:step with start <= stop and step > 0')
+            exit(1)
+        count = int(math.floor((stop - start) / step + 1e-9)) + 1
+        values.extend(start + i*step for i in range(count))
+    return values
+
+
+def printMultingSweep(materialList, results, initialWeight):
+    """Print drop weight and drop % per material and per job for every sweep point."""
+    print('\t'.join(['Max Stock', 'Kerf', 'Material', 'Drop Weight', 'Drop %']))
+    for (maxLen, kerf), drops in results.items():
+        jobDrop = 0.0
+        for materialName, dropLength in drops.items():
+            mat = materialList[materialName]
+            dropWeight = mat.weightPerFoot*dropLength
+            jobDrop += dropWeight
+            dropPercent = 100 * dropWeight / mat.weight if mat.weight else 0
+            print('\t'.join([str(maxLen), str(kerf), materialName, '%.2f' % dropWeight, '%.2f%%' % dropPercent]))
+        jobPercent = 100 * jobDrop / initialWeight if initialWeight else 0
+        print('\t'.join([str(maxLen), str(kerf), 'Job', '%.2f' % jobDrop, '%.2f%%' % jobPercent]))
+
+
+def deckCoverWidth(name):
+    """Cover width (ft) of a deck sheet from the profile at the start of its name, eg. '1.5B 20ga' -> 3."""
+    profile = name.split()[0] if name.split() else ''
+    return DECK_COVER_WIDTHS.get(profile, DECK_COVER_WIDTH)
+
+
+def deckRunSheets(length, maxSheet=DECK_MAX_SHEET, lap=DECK_END_LAP):
+    """Sheets to cover one deck run: (sheet count, sheet length). A run longer than the longest orderable sheet
+    is split into equal sheets that end lap, each rounded up to the next orderable length."""
+    count = max(1, math.ceil(round((length - lap) / (maxSheet - lap), 6)))
+    sheetLength = (length + (count - 1) * lap) / count
+    sheetLength = math.ceil(round(sheetLength / DECK_SHEET_INCREMENT, 6)) * DECK_SHEET_INCREMENT
+    return count, max(DECK_MIN_SHEET, sheetLength)
+
+
+def deckSheets(takeOffs, maxSheet=DECK_MAX_SHEET, lap=DECK_END_LAP):
+    """Order deck sheets for every deck run. Returns {deck name: {'sheets': {sheet length: count}, 'sheetCount',
+    'bundles', 'orderedSf', 'deckSf', 'wasteSf'}}.
+
+    Each run needs its sheet layout along its length times the sheets across the takeoff's width (SF / LF).
+    Runs are grouped by (length, sheets across) first, so each distinct run is laid out once however many
+    times it repeats."""
+    runs = {}
+    deckSf = {}
+    for index, tf in takeOffs['deck'].items():
+        if not tf.lengths or not tf.lf:
+            continue
+        name = deStubString(tf.name, STUB_LIST)
+        across = 1
+        if tf.sf:
+            across = math.ceil(round(tf.sf / tf.lf / deckCoverWidth(name), 6))
+        groups = runs.setdefault(name, collections.Counter())
+        groups.update((length, across) for length in tf.lengths)
+        deckSf[name] = deckSf.get(name, 0) + (tf.sf or 0)
+
+    results = {}
+    for name, groups in runs.items():
+        sheets = collections.Counter()
+        for (length, across), count in groups.items():
+            sheetCount, sheetLength = deckRunSheets(length, maxSheet, lap)
+            sheets[sheetLength] += sheetCount * across * count
+        sheetCount = sum(sheets.values())
+        orderedSf = deckCoverWidth(name) * sum(length * count for length, count in sheets.items())
+        results[name] = {
+            'sheets': dict(sorted(sheets.items(), reverse=True)),
+            'sheetCount': sheetCount,
+            'bundles': math.ceil(sheetCount / DECK_SHEETS_PER_BUNDLE),
+            'orderedSf': orderedSf,
+            'deckSf': deckSf[name],
+            'wasteSf': orderedSf - deckSf[name],
+        }
+
+    return results
+
+
+def reportSubtotals(takeOffs):
+    """Collect the factor-independent quantities the report's price formulas are built from."""
+    subtotals = {'initialWeight': 0.0, 'dropWeight': 0.0, 'deckSf': 0.0, 'deckLf': 0.0, 'mfPoints': 0}
+    for index, tfOut in takeOffs['struct'].items():
+        subtotals['initialWeight'] += tfOut.weight
+    for matName, mat in takeOffs['materialList'].items():
+        subtotals['dropWeight'] += mat.dropWeight
+    for index, tfOut in takeOffs['deck'].items():
+        subtotals['deckSf'] += tfOut.sf
+        subtotals['deckLf'] += tfOut.lf
+    for index, tfOut in takeOffs['cxn'].items():
+        subtotals['mfPoints'] += tfOut.count
+    return subtotals
 
 
-def main():
+def roundTotalPrice(total):
+    """Python equivalent of the spreadsheet formula printed on the Total Price line."""
+    roundedUp = math.ceil(total / 10) * 10
+    thousands = math.floor(total / 1000) * 1000
+    return max(min(roundedUp, thousands + 990), thousands + 700)
 
-    if len(sys.argv) < 3:
-        print('USAGE: report-generation.py TakeoffGeometry.csv CostByType.csv')
-        exit(1)
 
-    file1name = sys.argv[1]
-    file2name = sys.argv[2]
+def scenarioRead(scenarioFile):
+    """Read a price scenario grid. Columns are factor names (eg. STRUCT_PRICE_FACTOR), plus an optional 'Scenario' label.
+    Factors missing from the file keep their module default. Returns a dictionary of columns."""
+    colDict = {}
+    columns = {'Scenario': []}
+    for name in SCENARIO_FACTORS:
+        columns[name] = []
+
+    firstLine = 1
+    for line in scenarioFile:
+        if isBlank(line):
+            continue
+        data = [i.strip().strip('\"') for i in line.strip().split(',')]
+
+        # First line expected to have column names
+        if firstLine:
+            colDict = createColDict(data)
+            for name in colDict:
+                if name != 'Scenario' and name not in SCENARIO_FACTORS:
+                    diagnostic('WARN', 'scenario-column', 'Unknown scenario column '+name+' ignored.')
+            firstLine = 0
+            continue
+
+        rowNumber = len(columns['Scenario']) + 1
+        if 'Scenario' in colDict and not isBlank(data[colDict['Scenario']]):
+            columns['Scenario'].append(data[colDict['Scenario']])
+        else:
+            columns['Scenario'].append(str(rowNumber))
+
+        for name, default in SCENARIO_FACTORS.items():
+            if name in colDict and not isBlank(data[colDict[name]]):
+                columns[name].append(float(data[colDict[name]]))
+            else:
+                columns[name].append(default)
+
+    return columns
 
-    # Geometry Detail (Items)
-    tgdFile = open(file1name, 'r')
-    takeOffs = tgdRead(tgdFile)
 
-    # Item Cost by Type (Cost)
-    icbtFile = open(file2name, 'r')
-    takeOffs = icbtRead(icbtFile, takeOffs)
+def scenarioSweep(subtotals, scenarios):
+    """Evaluate every scenario column-wise against one set of precomputed subtotals."""
+    weight = subtotals['initialWeight']
+    drop = subtotals['dropWeight']
 
-    # Multing
-    takeOffs['materialList'] = multing(takeOffs['materialList'])
+    structPrice = [(weight + weight * misc + drop) * factor
+        for misc, factor in zip(scenarios['MISC_FACTOR'], scenarios['STRUCT_PRICE_FACTOR'])]
+    deckTotal = [subtotals['deckSf'] * deckFactor + subtotals['deckLf'] * lineFactor
+        for deckFactor, lineFactor in zip(scenarios['DECKING_PRICE_FACTOR'], scenarios['SAFETY_LINE_PRICE_FACTOR'])]
+    mfCost = [subtotals['mfPoints'] * hours * rate
+        for hours, rate in zip(scenarios['MF_HOURS_PER_POINT'], scenarios['MF_LABOR_RATE'])]
+    totalPrice = [roundTotalPrice(s + d + m) for s, d, m in zip(structPrice, deckTotal, mfCost)]
 
-    # Printing / Reporting
-    spacing = '\t\t\t\t\t'
+    return {'Struct Price': structPrice, 'Decking Total': deckTotal, 'MF Labor Cost': mfCost, 'Total Price': totalPrice}
 
-    # Column Definitions
-    weightColumn = 'I'
-    weightColumnTwo = chr(ord(weightColumn) + 1)
-    dataColumn = 'G'
-    dataColumnTwo = chr(ord(dataColumn) + 1)
-    countColumn = 'D'
-    sfColumn = 'G'
-    lfColumn = chr(ord(sfColumn) + 1)
 
+def defaultScenario():
+    """A one-row scenario grid holding the module's own factors."""
+    scenarios = {'Scenario': ['default']}
+    for name, default in SCENARIO_FACTORS.items():
+        scenarios[name] = [default]
+    return scenarios
+
+
+def substitutionRead(substitutionFile):
+    """Read section substitutions. Columns are From and To (any shape name spelling nameClean understands), plus
+    an optional 'Alternate' label; rows sharing a label are one alternate, unlabelled rows are each their own.
+    Returns {label: {from: to}} in file order."""
+    colDict = {}
+    alternates = {}
+    firstLine = 1
+    rowNumber = 0
+    for line in substitutionFile:
+        if isBlank(line):
+            continue
+        data = [i.strip().strip('\"') for i in line.strip().split(',')]
+
+        # First line expected to have column names
+        if firstLine:
+            colDict = createColDict(data)
+            if 'From' not in colDict or 'To' not in colDict:
+                print('ERROR: substitution file needs From and To columns')
+                exit(1)
+            firstLine = 0
+            continue
+
+        rowNumber += 1
+        label = str(rowNumber)
+        if 'Alternate' in colDict and not isBlank(data[colDict['Alternate']]):
+            label = data[colDict['Alternate']]
+        alternates.setdefault(label, {})[nameClean(data[colDict['From']])] = nameClean(data[colDict['To']])
+
+    return alternates
+
+
+def substituteSections(takeOffs, mapping, maxLen=MAX_STOCK, kerf=KERF):
+    """A copy of a multed takeOffs dictionary with every section in mapping swapped for its replacement.
+
+    Affected struct takeoffs (stubs included) are renamed and reweighed; everything else is shared with the
+    original. Weights scale by the ratio of the two nominal weights per foot when both shapes are in the table,
+    and by the job's own (cost report) weights per foot otherwise. Each replaced material's lengths move onto
+    its replacement, and only the replacements are mult again. Every move is worked out from the original
+    materials, so swaps (A -> B with B -> A) exchange and chains (A -> B with B -> C) shift."""
+    materialList = takeOffs['materialList']
+
+    def jobWeightPerFoot(name):
+        if name in materialList and materialList[name].weightPerFoot:
+            return materialList[name].weightPerFoot
+        return shapeWeightPerFoot(name)
+
+    # source -> (target, weight ratio or None, target lb/ft for sources with no weight basis)
+    moves = {}
+    for source, target in mapping.items():
+        targetPerFoot = jobWeightPerFoot(target)
+        if not targetPerFoot:
+            diagnostic('WARN', 'substitution-weight', 'No weight per foot for '+target+'; '+source+' -> '+target+' skipped.',
+                source=source, target=target)
+            continue
+        sourceNominal, targetNominal = shapeWeightPerFoot(source), shapeWeightPerFoot(target)
+        if sourceNominal and targetNominal:
+            ratio = targetNominal / sourceNominal
+        elif jobWeightPerFoot(source):
+            ratio = targetPerFoot / jobWeightPerFoot(source)
+        else:
+            ratio = None
+        moves[source] = (target, ratio, targetPerFoot)
+
+    def reweigh(weight, lf, move):
+        target, ratio, targetPerFoot = move
+        if ratio is not None:
+            return weight * ratio
+        return (lf or 0) * targetPerFoot
+
+    alternate = dict(takeOffs)
+    alternate['struct'] = {}
+    renamed = {}
+    for index, tf in takeOffs['struct'].items():
+        source = deStubString(tf.name, STUB_LIST)
+        if source in moves:
+            tfAlternate = copy.copy(tf)
+            tfAlternate.name = moves[source][0]+tf.name[len(source):]
+            tfAlternate.weight = reweigh(tf.weight, tf.lf, moves[source])
+            renamed[id(tf)] = tfAlternate
+            tf = tfAlternate
+        alternate['struct'][index] = tf
+
+    # Replacements start from the original target material, unless that is itself being replaced
+    targets = {}
+    for source, move in moves.items():
+        target = move[0]
+        if target not in targets:
+            targets[target] = Material(target, {})
+            if target in materialList and target not in moves:
+                kept = materialList[target]
+                targets[target].takeOffList.update(kept.takeOffList)
+                targets[target].lf += kept.lf
+                targets[target].weight += kept.weight
+                targets[target].mergeIndex(kept)
+        if source not in materialList:
+            continue
+        mat = materialList[source]
+        for index, tf in mat.takeOffList.items():
+            targets[target].takeOffList[index] = renamed.get(id(tf), tf)
+        targets[target].lf += mat.lf
+        targets[target].weight += reweigh(mat.weight, mat.lf, move)
+        targets[target].mergeIndex(mat)
+
+    for target, mat in targets.items():
+        mat.weightPerFoot = mat.weight / mat.lf if mat.lf else jobWeightPerFoot(target)
+
+    alternate['materialList'] = dict((name, mat) for name, mat in materialList.items() if name not in moves and name not in targets)
+    alternate['materialList'].update(multing(dict((name, mat) for name, mat in targets.items() if mat.takeOffList), maxLen, kerf))
+    return alternate
+
+
+def substitutionTotals(takeOffs):
+    """Weights and prices at the module's own factors, for comparing an alternate with the baseline."""
+    subtotals = reportSubtotals(takeOffs)
+    prices = scenarioSweep(subtotals, defaultScenario())
+    return {
+        'Initial Weight': subtotals['initialWeight'],
+        'Drop Weight': subtotals['dropWeight'],
+        'Struct Price': prices['Struct Price'][0],
+        'Total Price': prices['Total Price'][0],
+    }
+
+
+def planTakeOffs(takeOffs, plan):
+    """A takeOffs dictionary holding only one plan's takeoffs, with materials rebuilt over that plan's lengths."""
+    planIndex = takeOffs['plans'][plan]
+    partition = {'plans': {plan: planIndex}, 'materialList': {}}
+    for listing in ['struct', 'deck', 'cxn']:
+        partition[listing] = {}
+        for index in planIndex[listing]:
+            partition[listing][index] = takeOffs[listing][index]
+
+    for materialName, mat in takeOffs['materialList'].items():
+        takeOffList = {}
+        for index, tf in mat.takeOffList.items():
+            if tf.plan == plan:
+                takeOffList[index] = tf
+        if takeOffList:
+            planMat = Material(materialName, takeOffList)
+            planMat.weightPerFoot = mat.weightPerFoot
+            planMat.lf = sum(sum(tf.lengths) for tf in takeOffList.values())
+            for tf in takeOffList.values():
+                for length in tf.lengths:
+                    planMat.indexLength(length)
+            planMat.weight = planMat.lf * mat.weightPerFoot
+            partition['materialList'][materialName] = planMat
+
+    return partition
+
+
+def planSubtotals(partition):
+    """Mult one plan's materials and return its report subtotals, with the cut patterns per material under
+    'cutPatterns'. Runs in a worker process when parallel."""
+    partition['materialList'] = multing(partition['materialList'])
+    subtotals = reportSubtotals(partition)
+    subtotals['cutPatterns'] = dict((name, mat.cutPatterns) for name, mat in partition['materialList'].items())
+    return subtotals
+
+
+def partitionedSubtotals(takeOffs, workers=1):
+    """Subtotals per plan, each plan mult independently; in a process pool when workers > 1."""
+    plans = list(takeOffs['plans'].keys())
+    partitions = [planTakeOffs(takeOffs, plan) for plan in plans]
+    if workers > 1:
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(planSubtotals, partitions))
+    else:
+        results = [planSubtotals(partition) for partition in partitions]
+    return dict(zip(plans, results))
+
+
+def printPlanSubtotals(planResults, jobSubtotals):
+    """Print weight, drop and prices per plan, the plain sum of the plans, and the job as the full report prices it."""
+    print('\t'.join(['Plan', 'Weight', 'Tons', 'Drop Weight', 'Drop %', 'Struct Price', 'Decking Total', 'MF Labor Cost', 'Total Price']))
+    scenario = defaultScenario()
+
+    def row(label, subtotals):
+        prices = scenarioSweep(subtotals, scenario)
+        weight = subtotals['initialWeight']
+        dropPercent = 100 * subtotals['dropWeight'] / weight if weight else 0
+        print('\t'.join([
+            label,
+            '%.2f' % weight,
+            '%.2f' % (weight / 2000),
+            '%.2f' % subtotals['dropWeight'],
+            '%.2f%%' % dropPercent,
+            '%.2f' % prices['Struct Price'][0],
+            '%.2f' % prices['Decking Total'][0],
+            '%.2f' % prices['MF Labor Cost'][0],
+            '%.2f' % prices['Total Price'][0],
+        ]))
+
+    planSum = {'initialWeight': 0.0, 'dropWeight': 0.0, 'deckSf': 0.0, 'deckLf': 0.0, 'mfPoints': 0}
+    for plan, subtotals in planResults.items():
+        row(plan, subtotals)
+        for key in planSum:
+            planSum[key] += subtotals[key]
+    print('')
+    row('Sum of Plans', planSum)
+    row('Job', jobSubtotals)
+
+
+def printScenarios(scenarios, results):
+    """Print one row per scenario: its factors, then the resulting prices."""
+    factorNames = list(SCENARIO_FACTORS.keys())
+    resultNames = list(results.keys())
+    print('\t'.join(['Scenario'] + factorNames + resultNames))
+    for i, label in enumerate(scenarios['Scenario']):
+        row = [label]
+        row.extend(str(scenarios[name][i]) for name in factorNames)
+        row.extend('%.2f' % results[name][i] for name in resultNames)
+        print('\t'.join(row))
+
+
+def printSubstitutions(alternates, baseline, results):
+    """Print one row per alternate: its substitutions, then weight, drop and price changes against the baseline."""
+    resultNames = ['Initial Weight', 'Drop Weight', 'Struct Price', 'Total Price']
+    print('\t'.join(['Alternate', 'Substitutions'] + resultNames))
+    print('\t'.join(['Baseline', ''] + ['%.2f' % baseline[name] for name in resultNames]))
+    for label, mapping in alternates.items():
+        row = [label, '; '.join(source+' -> '+target for source, target in mapping.items())]
+        row.extend('%+.2f' % (results[label][name] - baseline[name]) for name in resultNames)
+        print('\t'.join(row))
+
+
+def printStruct(takeOffs, totalCells):
+    """Print the Struct section and its weight / price calculations. Returns the row range for the next section."""
     initialWeight = 0.0
 
     # Print Struct Items
@@ -527,73 +2074,108 @@ def main():
 
     # Print Struct Calculations
     print('')
-    print(spacing, 'Prelim Weight', '\t', '=SUM({}{}:{}{})'.format(weightColumn, printRange[0], weightColumn, printRange[1]), '\t', str(MISC_FACTOR), sep='')
-    print(spacing, 'Misc Weight', '\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+1, dataColumnTwo, printRange[1]+1), sep='')
-    print(spacing, 'Drop Weight', '\t', dropWeight, '\t(%.2f%%)' % (100 * dropWeight / initialWeight), sep='')
-    print(spacing, 'Final Weight', '\t', '=SUM({}{}:{}{})'.format(dataColumn, printRange[1]+1, dataColumn, printRange[1]+3), '\t', STRUCT_PRICE_FACTOR, sep='')
-    print(spacing, 'Struct Price', '\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+4, dataColumnTwo, printRange[1]+4), sep='')
+    print(SPACING, 'Prelim Weight', '\t', '=SUM({}{}:{}{})'.format(WEIGHT_COLUMN, printRange[0], WEIGHT_COLUMN, printRange[1]), '\t', str(MISC_FACTOR), sep='')
+    print(SPACING, 'Misc Weight', '\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+1, DATA_COLUMN_TWO, printRange[1]+1), sep='')
+    dropPercent = '\t(%.2f%%)' % (100 * dropWeight / initialWeight) if initialWeight else '\t(n/a)'
+    print(SPACING, 'Drop Weight', '\t', dropWeight, dropPercent, sep='')
+    print(SPACING, 'Final Weight', '\t', '=SUM({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+1, DATA_COLUMN, printRange[1]+3), '\t', STRUCT_PRICE_FACTOR, sep='')
+    print(SPACING, 'Struct Price', '\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+4, DATA_COLUMN_TWO, printRange[1]+4), sep='')
 
-    grandTotalLine = '={}{}'.format(dataColumn, printRange[1]+5)
-    printRange = [printRange[1]+6, printRange[1]+6]
+    totalCells.append('{}{}'.format(DATA_COLUMN, printRange[1]+5))
+    return [printRange[1]+6, printRange[1]+6]
 
-    if bool(takeOffs['deck']):
 
-        # Print Decking Items
-        deckSf = 0.0
-        deckLf = 0.0
-        print('')
-        print('Decking')
-        print('\t'.join(['DNL', 'Plan', 'Type', 'EA', '', 'Name', 'SF', 'LF']))
+def printDecking(takeOffs, printRange, totalCells):
+    """Print the Decking section and its price calculations, if there is any decking."""
+    if not bool(takeOffs['deck']):
+        return printRange
 
-        printRange = [printRange[1]+3, printRange[1]+3]
+    # Print Decking Items
+    deckSf = 0.0
+    deckLf = 0.0
+    print('')
+    print('Decking')
+    print('\t'.join(['DNL', 'Plan', 'Type', 'EA', '', 'Name', 'SF', 'LF']))
 
-        for index, tfOut in takeOffs['deck'].items():
-            deckSf += tfOut.sf
-            deckLf += tfOut.lf
-            print(tfOut.deckingSummary())
-            printRange[1] += 1
-    
-        # Print Decking Calculations
-        print('')
-        print(spacing, 'Total SF\t', '=SUM({}{}:{}{})'.format(sfColumn, printRange[0], sfColumn, printRange[1]), '\t', str(DECKING_PRICE_FACTOR), sep='')
-        print(spacing, 'Decking Subtotal\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+1, dataColumnTwo, printRange[1]+1), sep='')
-        print(spacing, 'Total LF\t', '=SUM({}{}:{}{})'.format(lfColumn, printRange[0], lfColumn, printRange[1]), '\t', str(SAFETY_LINE_PRICE_FACTOR), sep='')
-        print(spacing, 'Safety Line Subtotal\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+3, dataColumnTwo, printRange[1]+3), sep='')
-        print(spacing, 'Decking Total\t', '={}{}+{}{}'.format(dataColumn, printRange[1]+2, dataColumn, printRange[1]+4), sep='')
+    printRange = [printRange[1]+3, printRange[1]+3]
 
-        grandTotalLine = grandTotalLine+'+{}{}'.format(dataColumn, printRange[1]+5)
-        printRange = [printRange[1]+6, printRange[1]+6]
+    for index, tfOut in takeOffs['deck'].items():
+        deckSf += tfOut.sf
+        deckLf += tfOut.lf
+        print(tfOut.deckingSummary())
+        printRange[1] += 1
 
-    mfCost = 0
-    if bool(takeOffs['cxn']):
+    # Print Decking Calculations
+    print('')
+    print(SPACING, 'Total SF\t', '=SUM({}{}:{}{})'.format(SF_COLUMN, printRange[0], SF_COLUMN, printRange[1]), '\t', str(DECKING_PRICE_FACTOR), sep='')
+    print(SPACING, 'Decking Subtotal\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+1, DATA_COLUMN_TWO, printRange[1]+1), sep='')
+    print(SPACING, 'Total LF\t', '=SUM({}{}:{}{})'.format(LF_COLUMN, printRange[0], LF_COLUMN, printRange[1]), '\t', str(SAFETY_LINE_PRICE_FACTOR), sep='')
+    print(SPACING, 'Safety Line Subtotal\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+3, DATA_COLUMN_TWO, printRange[1]+3), sep='')
+    print(SPACING, 'Decking Total\t', '={}{}+{}{}'.format(DATA_COLUMN, printRange[1]+2, DATA_COLUMN, printRange[1]+4), sep='')
 
-        # Print MF Labor
-        mfPoints = 0
-        print('')
-        print('MF Labor')
-        print('\t'.join(['DNL', 'Plan', 'Type', 'EA', '', 'Name']))
+    totalCells.append('{}{}'.format(DATA_COLUMN, printRange[1]+5))
+    return [printRange[1]+6, printRange[1]+6]
 
-        printRange = [printRange[1]+3, printRange[1]+3]
 
-        for index, tfOut in takeOffs['cxn'].items():
-            mfPoints += tfOut.count
-            print(tfOut.mfSummary())
-            printRange[1] += 1
-    
-        # Print MF Labor Calculations
-        print('')
-        print(spacing, 'Total Points\t', '=SUM({}{}:{}{})'.format(countColumn, printRange[0], countColumn, printRange[1]), '\t', MF_HOURS_PER_POINT, sep='')
-        print(spacing, 'Total Hours\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+1, dataColumnTwo, printRange[1]+1), '\t', MF_LABOR_RATE, sep='')
-        print(spacing, 'MF Labor Cost\t', '=PRODUCT({}{}:{}{})'.format(dataColumn, printRange[1]+2, dataColumnTwo, printRange[1]+2), sep='')
+def printDeckSheets(takeOffs):
+    """Print the deck sheet order by length, then sheets, bundles and waste per deck. Nothing without deck runs."""
+    results = deckSheets(takeOffs)
+    if not results:
+        return
+    print('')
+    print('\t'.join(['Deck Sheets', 'Length', 'Sheets']))
+    for name, result in results.items():
+        for length, count in result['sheets'].items():
+            print('\t'.join([name, feetInches(length), str(count)]))
+    print('')
+    print('\t'.join(['Deck Order', 'Sheets', 'Bundles', 'Ordered SF', 'Deck SF', 'Waste SF', 'Waste %']))
+    for name, result in results.items():
+        wastePercent = 100 * result['wasteSf'] / result['orderedSf'] if result['orderedSf'] else 0
+        print('\t'.join([
+            name,
+            str(result['sheetCount']),
+            str(result['bundles']),
+            '%.2f' % result['orderedSf'],
+            '%.2f' % result['deckSf'],
+            '%.2f' % result['wasteSf'],
+            '%.2f%%' % wastePercent,
+        ]))
+
+
+def printMfLabor(takeOffs, printRange, totalCells):
+    """Print the MF Labor section and its cost calculations, if there are any connections."""
+    if not bool(takeOffs['cxn']):
+        return printRange
+
+    # Print MF Labor
+    mfPoints = 0
+    print('')
+    print('MF Labor')
+    print('\t'.join(['DNL', 'Plan', 'Type', 'EA', '', 'Name']))
+
+    printRange = [printRange[1]+3, printRange[1]+3]
 
-        grandTotalLine = grandTotalLine+'+{}{}'.format(dataColumn, printRange[1]+3)
-        printRange = [printRange[1]+4, printRange[1]+4]
+    for index, tfOut in takeOffs['cxn'].items():
+        mfPoints += tfOut.count
+        print(tfOut.mfSummary())
+        printRange[1] += 1
+
+    # Print MF Labor Calculations
+    print('')
+    print(SPACING, 'Total Points\t', '=SUM({}{}:{}{})'.format(COUNT_COLUMN, printRange[0], COUNT_COLUMN, printRange[1]), '\t', MF_HOURS_PER_POINT, sep='')
+    print(SPACING, 'Total Hours\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+1, DATA_COLUMN_TWO, printRange[1]+1), '\t', MF_LABOR_RATE, sep='')
+    print(SPACING, 'MF Labor Cost\t', '=PRODUCT({}{}:{}{})'.format(DATA_COLUMN, printRange[1]+2, DATA_COLUMN_TWO, printRange[1]+2), sep='')
 
-    # Print Total Line
-    totalCell = '{}{}'.format(dataColumn, printRange[1]+1)
+    totalCells.append('{}{}'.format(DATA_COLUMN, printRange[1]+3))
+    return [printRange[1]+4, printRange[1]+4]
+
+
+def printTotal(printRange, totalCells):
+    """Print the Total Price line over the priced sections that were printed, then the footer."""
+    totalCell = '{}{}'.format(DATA_COLUMN, printRange[1]+1)
     roundedTotal = '=MAX(MIN(ROUNDUP('+totalCell+',-1),ROUNDDOWN('+totalCell+',-3)+990),ROUNDDOWN('+totalCell+',-3)+700)'
     print('')
-    print(spacing, 'Total Price\t', grandTotalLine, '\t', roundedTotal, sep='')
+    print(SPACING, 'Total Price\t', '='+'+'.join(totalCells), '\t', roundedTotal, sep='')
 
     # Placeholder for sheet range and date. Has to be manually entered.
     print('')
@@ -602,12 +2184,209 @@ def main():
     print('Pages:')
     print('Date:')
 
+
+def printWeightList(takeOffs):
+    """Print the grouped weight list for every struct takeoff, as weightlist-generation.py does."""
+    print('Qty'+'\t\t'+'Description'+'\t'+'Length'+'\t'+'Weight')
+    for index, tfOut in takeOffs['struct'].items():
+        for row in tfOut.weightList():
+            print('\t'.join(str(cell) for cell in row))
+
+
+def main():
+
+    global DIAGNOSTICS
+    args = sys.argv[1:]
+    diagnosticsTarget = popOption(args, '--diagnostics', '')
+    diagnosticsCap = popIntOption(args, '--diagnostics-cap', DIAGNOSTICS_CAP)
+    DIAGNOSTICS = Diagnostics('' if diagnosticsTarget == 'stdout' else diagnosticsTarget, diagnosticsCap)
+    isJoint = popFlag(args, '--joint')
+    remnantFileName = popOption(args, '--remnants')
+    scenarioFileName = popOption(args, '--scenarios')
+    substitutionFileName = popOption(args, '--substitute')
+    sweepStock = popOption(args, '--sweep-stock')
+    sweepKerf = popOption(args, '--sweep-kerf')
+    sections = popOption(args, '--sections')
+    showTimings = popFlag(args, '--timings')
+    isByPlan = popFlag(args, '--by-plan')
+    workers = popIntOption(args, '--workers', 1, 1)
+    cutTicketFileName = popOption(args, '--cut-tickets')
+    estimateDrop = popFlag(args, '--estimate-drop')
+    query = popOption(args, '--query')
+
+    if sections:
+        sections = [i.strip() for i in sections.split(',') if not isBlank(i)]
+        for section in sections:
+            if section not in SECTION_STAGES:
+                print('ERROR: unknown section '+section+'; expected some of '+','.join(SECTION_STAGES))
+                exit(1)
+    else:
+        sections = DEFAULT_SECTIONS
+
+    # The estimate packs no bars, so there would be nothing to cut (--by-plan mults each plan exactly)
+    if estimateDrop and cutTicketFileName and not isByPlan:
+        print('ERROR: --cut-tickets needs exact multing; drop --estimate-drop')
+        exit(1)
+
+    if query and query not in ['summary', 'distribution']:
+        print('ERROR: unknown query '+query+'; expected summary or distribution')
+        exit(1)
+
+    if popFlag(args, '--build-shapes'):
+        writeShapeTable()
+        print('Wrote '+SHAPE_TABLE_FILE)
+        return
+
+    if args.count('-') > 1:
+        print('ERROR: - (stdin) can be given only once')
+        exit(1)
+
+    # Without a cost report, weights come from the nominal shape table
+    if len(args) < 1 or (isJoint and len(args) < 2):
+        print('USAGE: report-generation.py TakeoffGeometry.csv [More.csv ...] [CostByType.csv ...] [--scenarios Scenarios.csv]'
+            +' [--sweep-stock 60,65 | 40:65:5] [--sweep-kerf 0.125,0.25]')
+        print('       report-generation.py TakeoffGeometry.csv [CostByType.csv] --sections struct,deck,cxn,multing,weightlist,reconcile,sheets [--timings]')
+        print('       report-generation.py TakeoffGeometry.csv [CostByType.csv] --by-plan [--workers 4]')
+        print('       report-generation.py TakeoffGeometry.csv [CostByType.csv] --substitute Substitutions.csv')
+        print('       report (all plans) or --by-plan (per plan): [--cut-tickets CutTickets.csv]')
+        print('       report: [--estimate-drop] to estimate drop from the length histogram instead of multing every piece;'
+            +' its low / high columns are a heuristic range, not a confidence interval')
+        print('       inputs may be gzip, bz2, xz or zstd compressed; - reads one of them from stdin')
+        print('       report-generation.py TakeoffGeometry.csv [More.csv ...] --query summary | distribution')
+        print('       report-generation.py --build-shapes')
+        print('       any mode: [--diagnostics stdout | stderr | Diagnostics.jsonl] [--diagnostics-cap 20]')
+        print('       report-generation.py --joint JobA.tgd.csv JobA.icbt.csv JobB.tgd.csv JobB.icbt.csv ... [--remnants Remnants.csv]')
+        exit(1)
+
+    # Joint multing across jobs, drawing on and refilling the remnant inventory, then stop
+    if isJoint:
+        if len(args) % 2:
+            print('ERROR: --joint takes a geometry and a cost file per job; no cost file for '+args[-1])
+            exit(1)
+        jobs = {}
+        for i in range(0, len(args) - 1, 2):
+            jobName = os.path.splitext(os.path.basename(args[i]))[0]
+            if jobName in jobs:
+                jobName = jobName+'#'+str(i//2 + 1)
+            takeOffs = tgdRead(openInput(args[i]))
+            jobs[jobName] = applyShapeWeights(icbtRead(openInput(args[i+1]), takeOffs))
+
+        inventory = RemnantInventory()
+        if remnantFileName and os.path.exists(remnantFileName):
+            inventory.read(open(remnantFileName, 'r'))
+
+        attribution, barCounts = jointMulting(jobs, inventory)
+        printJointMulting(jobs, attribution, barCounts)
+
+        if remnantFileName:
+            inventory.write(open(remnantFileName, 'w'))
+        DIAGNOSTICS.finish()
+        return
+
+    # Any number of geometry and cost exports, told apart by their first line
+    icbtFileNames = [i for i in args if isIcbtFile(i)]
+    tgdFileNames = [i for i in args if i not in icbtFileNames]
+    if not tgdFileNames:
+        print('ERROR: no Takeoff Geometry Detail file given')
+        exit(1)
+    pipeline = ReportPipeline(tgdFileNames, icbtFileNames, workers, estimateDrop)
+
+    # Length questions answered from the parse-time length index, then stop
+    if query:
+        printLengthQuery(pipeline.parsed()['materialList'], query)
+        DIAGNOSTICS.finish()
+        return
+
+    # Stock / kerf sensitivity: mult every sweep point from the same length lists, then stop
+    if sweepStock or sweepKerf:
+        takeOffs = pipeline.joined()
+        maxLens = parseSweepValues(sweepStock) if sweepStock else [MAX_STOCK]
+        kerfs = parseSweepValues(sweepKerf) if sweepKerf else [KERF]
+        results = multingSweep(takeOffs['materialList'], maxLens, kerfs)
+        printMultingSweep(takeOffs['materialList'], results, reportSubtotals(takeOffs)['initialWeight'])
+        DIAGNOSTICS.finish()
+        return
+
+    # Per-plan subtotals, each plan mult on its own, with the whole job for the rollup; then stop
+    if isByPlan:
+        takeOffs = pipeline.joined()
+        planResults = partitionedSubtotals(takeOffs, workers)
+        printPlanSubtotals(planResults, reportSubtotals(pipeline.multed()))
+        if cutTicketFileName:
+            with open(cutTicketFileName, 'w') as cutFile:
+                writeCutTickets(cutFile, dict((plan, subtotals['cutPatterns']) for plan, subtotals in planResults.items()))
+        DIAGNOSTICS.finish()
+        return
+
+    # Price scenarios: evaluate the whole grid against one parse, then stop
+    if scenarioFileName:
+        takeOffs = pipeline.multed()
+        scenarioFile = open(scenarioFileName, 'r')
+        scenarios = scenarioRead(scenarioFile)
+        printScenarios(scenarios, scenarioSweep(reportSubtotals(takeOffs), scenarios))
+        DIAGNOSTICS.finish()
+        return
+
+    # What-if section substitutions: each alternate against the one parsed and mult baseline, then stop
+    if substitutionFileName:
+        takeOffs = pipeline.multed()
+        alternates = substitutionRead(open(substitutionFileName, 'r'))
+        results = {}
+        for label, mapping in alternates.items():
+            results[label] = substitutionTotals(substituteSections(takeOffs, mapping))
+        printSubstitutions(alternates, substitutionTotals(takeOffs), results)
+        DIAGNOSTICS.finish()
+        return
+
+    # Printing / Reporting. Each section pulls only the pipeline stages it needs.
+    # printRange[1] tracks the spreadsheet row of the last line printed by the previous section.
+    printRange = [1,1]
+    totalCells = []
+
+    if 'struct' in sections:
+        printRange = printStruct(pipeline.stage(SECTION_STAGES['struct']), totalCells)
+
+    if 'deck' in sections:
+        printRange = printDecking(pipeline.stage(SECTION_STAGES['deck']), printRange, totalCells)
+
+    if 'cxn' in sections:
+        printRange = printMfLabor(pipeline.stage(SECTION_STAGES['cxn']), printRange, totalCells)
+
+    if totalCells:
+        printTotal(printRange, totalCells)
+
+    if 'multing' in sections:
+        print('')
+        if estimateDrop:
+            printDropEstimate(pipeline.stage(SECTION_STAGES['multing'])['materialList'])
+        else:
+            printMultingQuality(pipeline.stage(SECTION_STAGES['multing'])['materialList'])
+
+    if 'weightlist' in sections:
+        print('')
+        printWeightList(pipeline.stage(SECTION_STAGES['weightlist']))
+
+    if 'reconcile' in sections:
+        printReconciliation(pipeline.stage(SECTION_STAGES['reconcile']))
+
+    if 'sheets' in sections:
+        printDeckSheets(pipeline.stage(SECTION_STAGES['sheets']))
+
+    if cutTicketFileName:
+        materialList = pipeline.multed()['materialList']
+        with open(cutTicketFileName, 'w') as cutFile:
+            writeCutTickets(cutFile, {'All': dict((name, mat.cutPatterns) for name, mat in materialList.items())})
+
     # Warnings / Messages
     print('')
-    for message in MESSAGE_OUTPUT:
-        print(message)
+    DIAGNOSTICS.finish()
+
+    if showTimings:
+        for stage in pipeline.stagesRun:
+            print(stage+'\t%.6f' % pipeline.timings[stage], file=sys.stderr)
 
-main()
+if __name__ == '__main__':
+    main()
 
 # TODO:
 # √ Read and stitch cost data
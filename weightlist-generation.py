@@ -1,10 +1,23 @@
 #!/usr/local/bin/python3.6
 
+import heapq
+import io
+import json
 import math
 import re
 import sys
 
-MESSAGE_OUTPUT = []
+# Decompressors are imported only when an input needs one, so a plain run starts as fast as possible.
+
+# Compressed inputs, told apart by their first bytes
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
+
+DIAGNOSTICS_CAP = 20 # Distinct messages kept per diagnostic code; the rest are only counted
 
 KERF = 0.25
 MAX_STOCK = 65
@@ -45,6 +58,39 @@ class Material:
             lengths.extend(tfData.lengths)
         return sorted(lengths, reverse = True)
 
+    def cutList(self):
+        """Weight list rows for the whole material: every takeoff's lengths, rounded up to 6", k-way merged and
+        grouped by length in one pass, with the quantity per plan for each length."""
+        streams = []
+        for index, tf in self.takeOffList.items():
+            if tf.typeName in DNL_LIST or tf.typeName == 'Decking':
+                continue
+            streams.append([(math.ceil(float(length)*2)/2, tf.plan) for length in sorted(tf.lengths)])
+
+        output = []
+        row = None
+        for length, plan in heapq.merge(*streams):
+            if row is None or row['length'] != length:
+                feet = math.floor(length)
+                lengthOut = "{0:d}\'".format(feet)
+                if length % 1: # non-integer foot length
+                    lengthOut = lengthOut+" 6\""
+                row = {'qty': 0, 'length': length, 'lengthOut': lengthOut, 'weight': 0, 'plans': {}}
+                output.append(row)
+            row['qty'] += 1
+            row['weight'] += round(self.weightPerFoot * length)
+            row['plans'][plan] = row['plans'].get(plan, 0) + 1
+
+        return [[
+            row['qty'],
+            '',
+            self.name,
+            row['lengthOut'],
+            row['weight'],
+            self.weightPerFoot,
+            ', '.join(plan+': '+str(qty) for plan, qty in row['plans'].items()),
+        ] for row in output]
+
 class Takeoff:
     def __init__(self, plan='', typeName='', name='', rawName='', description='', sf=0, lf=0, count=0, lengths=[], weight=0, dnl=''):
         self.plan = plan
@@ -123,8 +169,79 @@ class Takeoff:
         return output
 
 
+class Diagnostics:
+    """Warnings and notes raised while reading and reporting.
+
+    Records are typed by code and deduplicated: a repeat of the same code and message only bumps its count, and
+    after cap distinct messages per code the rest are only counted, so memory stays flat on bad exports.
+    target '' holds the records for the end of the report; 'stderr' or a .jsonl file name streams each new record
+    as it happens and writes the counts at the end."""
+    def __init__(self, target='', cap=DIAGNOSTICS_CAP):
+        self.target = target
+        self.cap = cap
+        self.records = {}
+        self.codeCounts = {}
+        self.stream = None
+        if target == 'stderr':
+            self.stream = sys.stderr
+        elif target:
+            self.stream = open(target, 'w')
+
+    def add(self, level, code, message, count=1, **fields):
+        counts = self.codeCounts.setdefault(code, {'distinct': 0, 'total': 0})
+        counts['total'] += count
+        key = (code, message)
+        if key in self.records:
+            self.records[key]['count'] += count
+            return
+        if counts['distinct'] >= self.cap:
+            return
+        counts['distinct'] += 1
+        record = {'level': level, 'code': code, 'message': message}
+        record.update(fields)
+        record['count'] = count
+        self.records[key] = record
+        self.emit(record)
+
+    def emit(self, record):
+        if self.stream is None:
+            return
+        if self.target == 'stderr':
+            print(record['level']+': '+record['message'], file=self.stream)
+        else:
+            self.stream.write(json.dumps(dict((k, v) for k, v in record.items() if k != 'count'))+'\n')
+        self.stream.flush()
+
+    def finish(self):
+        """Print the held records (default target), or write the per-code counts to the stream."""
+        if self.stream is None:
+            for record in self.records.values():
+                suffix = ' (x'+str(record['count'])+')' if record['count'] > 1 else ''
+                print(record['level']+': '+record['message']+suffix)
+        shown = {}
+        for record in self.records.values():
+            shown[record['code']] = shown.get(record['code'], 0) + record['count']
+        for code, counts in self.codeCounts.items():
+            hidden = counts['total'] - shown.get(code, 0)
+            if self.stream is None:
+                if hidden:
+                    print('NOTE: '+str(hidden)+' more '+code+' messages not shown')
+            elif self.target == 'stderr':
+                print('NOTE: '+code+': '+str(counts['total'])+' total, '+str(hidden)+' not shown', file=self.stream)
+            else:
+                self.stream.write(json.dumps({'level': 'SUMMARY', 'code': code, 'total': counts['total'], 'notShown': hidden})+'\n')
+        if self.stream not in (None, sys.stderr):
+            self.stream.close()
+
+DIAGNOSTICS = Diagnostics()
+
 # FUNCTIONS
 
+def diagnostic(level, code, message, **fields):
+    """Record a warning (level 'WARN') or note ('NOTE') under a stable code, eg. 'duplicate-entry'."""
+    DIAGNOSTICS.add(level, code, message, **fields)
+
+
 def createColDict(colNames):
     """Generate a column dictionary from a list."""
     colDict = {}
@@ -187,9 +304,71 @@ def nameClean(name):
     return name.rstrip()
 
 
+def popFlag(args, flag):
+    """Remove a bare '--flag' from args and return whether it was present."""
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
+
+
+def popOption(args, flag, default=None):
+    """Remove a '--flag value' pair from args and return the value (or default if the flag is absent)."""
+    if flag in args:
+        i = args.index(flag)
+        if i + 1 >= len(args):
+            print('ERROR: '+flag+' requires a value')
+            exit(1)
+        value = args[i+1]
+        del args[i:i+2]
+        return value
+    return default
+
+
+def popIntOption(args, flag, default, minimum=0):
+    """popOption for a whole number of at least minimum."""
+    value = popOption(args, flag, default)
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        print('ERROR: '+flag+' needs a whole number of at least '+str(minimum))
+        exit(1)
+    return value
+
+
+def openInput(fileName):
+    """Open an export for reading lines. gzip, bz2, xz and (with the zstandard module) zstd are decoded as they
+    are read, recognized by their magic bytes rather than the extension. '-' is stdin."""
+    binaryFile = sys.stdin.buffer if fileName == '-' else open(fileName, 'rb')
+    magic = binaryFile.peek(6)
+    for prefix, codec in COMPRESSION_MAGIC:
+        if not magic.startswith(prefix):
+            continue
+        if codec == 'gzip':
+            import gzip
+            binaryFile = gzip.GzipFile(fileobj=binaryFile)
+        elif codec == 'bz2':
+            import bz2
+            binaryFile = bz2.BZ2File(binaryFile)
+        elif codec == 'xz':
+            import lzma
+            binaryFile = lzma.LZMAFile(binaryFile)
+        else:
+            try:
+                import zstandard
+            except ImportError:
+                print('ERROR: zstd input needs the zstandard module (pip install zstandard)')
+                exit(1)
+            binaryFile = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(binaryFile))
+        break
+    return io.TextIOWrapper(binaryFile)
+
+
 def tgdRead(filename):
     """Read Takeoff Geomoetry Detail File (Items)"""
-    tgdFile = open(filename, 'r')
+    tgdFile = openInput(filename)
     
     colDict = {}
     takeOffs = {'struct': {}, 'deck': {}, 'cxn': {}, 'materialList': {}}
@@ -238,12 +417,13 @@ def tgdRead(filename):
 
             # Type 'None' encountered
             if data[colDict['Type']] == 'None':
-                MESSAGE_OUTPUT.append("WARN: Type of 'None' encountered: "
+                diagnostic('WARN', 'type-none', "Type of 'None' encountered: "
                     +data[colDict['Plan Name']]+" | "
                     +data[colDict['Type']]+" | "
                     +data[colDict['EA']]+" | "
                     +data[colDict['Name']]+" | "
-                    +data[colDict['Description']]
+                    +data[colDict['Description']],
+                    plan=data[colDict['Plan Name']], name=data[colDict['Name']]
                 )
 
             # If we already have this index, don't create a new Takeoff. The name, description, and index variables remain unchanged,
@@ -251,7 +431,8 @@ def tgdRead(filename):
             if index in takeOffs[listing]:
                 tf.count += int(data[colDict['EA']])
                 if takeOffs[listing][index].rawName == rawName:
-                    MESSAGE_OUTPUT.append("WARN: Duplicate entry of "+index+" in Takeoff Geometry Detail. Unedited Name is "+rawName)
+                    diagnostic('WARN', 'duplicate-entry', "Duplicate entry of "+index+" in Takeoff Geometry Detail. Unedited Name is "+rawName,
+                        index=index, rawName=rawName)
 
             else:
 
@@ -260,7 +441,7 @@ def tgdRead(filename):
                 if name.split():
                     lastName = name.split()[-1]
                 if lastName in STUB_LIST:
-                    #MESSAGE_OUTPUT.append("NOTE: "+name+" were included as stubs. Their lengths, lineal footage, and weight are included in the more generic "+deStubString(name)+" listing; their counts are not.")
+                    #diagnostic('NOTE', 'stub', name+" were included as stubs. Their lengths, lineal footage, and weight are included in the more generic "+deStubString(name)+" listing; their counts are not.")
     
                     indexStub = index
                     index = deStubString(index, STUB_LIST)
@@ -342,7 +523,7 @@ def tgdRead(filename):
 
 def icbtRead(filename, takeOffs):
     """Read Item Cost by Type File (Cost)"""
-    icbtFile = open(filename, 'r')
+    icbtFile = openInput(filename)
     
     isFirstLine = 1
     colNameLine = 0
@@ -401,7 +582,8 @@ def icbtRead(filename, takeOffs):
             takeOffs['struct'][index] = tf
 
             if tf.name.startswith('HSS') and ( tf.typeName == 'Beam' or tf.typeName == 'Column' ):
-                MESSAGE_OUTPUT.append(tf.name+' ('+tf.typeName+') was added in the cost report. This might be an item not found in STACK (eg. HSS 7x3x1/4 -> HSS 6x4x1/4), or a pipe column.')
+                diagnostic('WARN', 'cost-only-hss', tf.name+' ('+tf.typeName+') was added in the cost report. This might be an item not found in STACK (eg. HSS 7x3x1/4 -> HSS 6x4x1/4), or a pipe column.',
+                    name=tf.name, type=tf.typeName)
 
         # This has an entry in material list:
         if name in takeOffs['materialList']:
@@ -416,20 +598,33 @@ def icbtRead(filename, takeOffs):
         # Or it's new in the cost report:
         else:
             if (tf.typeName not in DNL_LIST) and ('Plate' not in tf.name):
-                MESSAGE_OUTPUT.append(tf.name+' was added to the material list from the cost report.')
-                MESSAGE_OUTPUT.append(tf)
+                diagnostic('NOTE', 'cost-only-material', tf.name+' ('+tf.plan+' | '+tf.typeName+', '+'%.2f' % tf.weight+' lb) was added to the material list from the cost report.',
+                    plan=tf.plan, type=tf.typeName, name=tf.name, weight=tf.weight)
 
     return takeOffs
 
 
 def main():
 
-    if len(sys.argv) < 3:
-        print('USAGE: report-generation.py TakeoffGeometry.csv CostByType.csv')
+    global DIAGNOSTICS
+    args = sys.argv[1:]
+    diagnosticsTarget = popOption(args, '--diagnostics', '')
+    diagnosticsCap = popIntOption(args, '--diagnostics-cap', DIAGNOSTICS_CAP)
+    DIAGNOSTICS = Diagnostics('' if diagnosticsTarget == 'stdout' else diagnosticsTarget, diagnosticsCap)
+    isCutList = popFlag(args, '--cut-list')
+
+    if len(args) < 2:
+        print('USAGE: weightlist-generation.py TakeoffGeometry.csv CostByType.csv [--cut-list]'
+            +' [--diagnostics stdout | stderr | Diagnostics.jsonl] [--diagnostics-cap 20]')
+        print('       inputs may be gzip, bz2, xz or zstd compressed; - reads one of them from stdin')
         exit(1)
 
-    file1name = sys.argv[1]
-    file2name = sys.argv[2]
+    if args.count('-') > 1:
+        print('ERROR: - (stdin) can be given only once')
+        exit(1)
+
+    file1name = args[0]
+    file2name = args[1]
 
     # Geometry Detail (Items)
     takeOffs = tgdRead(file1name)
@@ -437,6 +632,16 @@ def main():
     # Item Cost by Type (Cost)
     takeOffs = icbtRead(file2name, takeOffs)
 
+    # Print one merged cut list per material instead of one list per takeoff
+    if isCutList:
+        print('Qty'+'\t\t'+'Description'+'\t'+'Length'+'\t'+'Weight'+'\t'+'lb/ft'+'\t'+'Plans')
+        for materialName, mat in takeOffs['materialList'].items():
+            for row in mat.cutList():
+                print('\t'.join(str(cell) for cell in row))
+        print('')
+        DIAGNOSTICS.finish()
+        return
+
     # Print Items
 
     print('Qty'+'\t\t'+'Description'+'\t'+'Length'+'\t'+'Weight')
@@ -456,7 +661,7 @@ def main():
 
     # Warnings / Messages
     print('')
-    for message in MESSAGE_OUTPUT:
-        print(message)
+    DIAGNOSTICS.finish()
 
-main()
+if __name__ == '__main__':
+    main()